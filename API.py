@@ -58,6 +58,26 @@ def index():
         bot.set_classifiers(request.form["value"])
         return "1"
 
+    if request.form["action"] == "get_classifier_latency":
+        logger.debug("get_classifier_latency called")
+        return bot.get_classifier_latency()
+
+    if request.form["action"] == "get_thermal_acquisition_stats":
+        logger.debug("get_thermal_acquisition_stats called")
+        return bot.get_thermal_acquisition_stats()
+
+    if request.form["action"] == "get_classifier_gating_stats":
+        logger.debug("get_classifier_gating_stats called")
+        return bot.get_classifier_gating_stats()
+
+    if request.form["action"] == "get_classifier_rates":
+        logger.debug("get_classifier_rates called")
+        return bot.get_classifier_rates()
+
+    if request.form["action"] == "get_classifier_cache_stats":
+        logger.debug("get_classifier_cache_stats called")
+        return bot.get_classifier_cache_stats()
+
     if request.form["action"] == "get_temperature_setpoint":
         logger.debug("get_temperature_setpoint called")
         return bot.get_temperature_setpoint()
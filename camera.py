@@ -1,37 +1,201 @@
 import multiprocessing as mp
-from multiprocessing import JoinableQueue, Event
+from multiprocessing import JoinableQueue, Event, Value
+from threading import Thread, Lock, Event as ThreadEvent
 from queue import Empty
+import io
+import time
+import numpy as np
 
-from picamera import PiCamera
+from camera_backends import open_backend
+from frame_buffer import FrameRing
+from config import Settings, Classifiers
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+config = Settings()
+classifiers = Classifiers()
+
+
+FRAME_SLOTS = 4
+
+# Encoding happens on the GPU, which only writes these formats
+CAMERA_FORMATS = ("jpeg", "png")
+CAPTURE_TIMEOUT = 2.0  # Seconds to wait for each stream's first frame
+
+# Splitter port 0 carries the archival image, the rest are free for model inputs
+MODEL_PORTS = (1, 2, 3)
+
+
+def _padded(shape):
+    """Buffer shape picamera writes raw RGB into (width to 32, height to 16)"""
+    height, width, channels = shape
+    return (-(-height // 16) * 16, -(-width // 32) * 32, channels)
+
+
+def model_shapes():
+    """Distinct (height, width, channels) inputs of the camera and fused classifiers"""
+
+    library = classifiers.get_classifiers()
+    shapes = sorted(
+        {
+            classifiers.get_input_shape(name)
+            for name, attr in library.items()
+            if attr.get("input", "camera") != "thermal"
+        }
+    )
+    if len(shapes) > len(MODEL_PORTS):
+        raise ValueError(
+            "Camera can stream at most %d model input sizes, got %s"
+            % (len(MODEL_PORTS), shapes)
+        )
+    return shapes
+
 
 class Camera(object):
-    """Control the camera using the Picamera module (threaded)"""
+    """Control the camera through a pluggable capture backend (multiprocessing)"""
 
     def __init__(self):
         self.file_queue = JoinableQueue(1)
 
+        # Checked here so a bad setting fails at startup, not in the worker
+        self.image_format = config.get_setting("camera_format")
+        if self.image_format not in CAMERA_FORMATS:
+            raise ValueError("Camera cannot encode %s" % (self.image_format))
+
         self.quit_event = Event()
 
+        # Keep the video port running and serve the latest frame on request
+        self.streaming = config.get_setting("camera_streaming")
+
+        # Wall clock time the latest saved image was captured, set by the worker
+        self.capture_time = Value("d", 0.0)
+
+        # RGB frames at each model input size, published with every streamed image.
+        # Still captures are decoded by the classifier rather than captured twice
+        self.shapes = model_shapes() if self.streaming else []
+        self.rings = {
+            shape: FrameRing(shape, dtype=np.uint8, slots=FRAME_SLOTS)
+            for shape in self.shapes
+        }
+
     def _worker(self):
 
         logger.info("Initialising camera...")
 
-        camera = PiCamera()
-        camera.rotation = 180
-        camera.zoom = (0.05, 0.0, 0.75, 0.95)
-        camera.resolution = (1024, 768)
+        camera = open_backend(config)
+
+        image_format = self.image_format
+        size = config.get_setting("camera_size")
+        options = {}
+        if image_format == "jpeg":
+            options["quality"] = config.get_setting("camera_quality")
+
+        # Raw RGB is resized on the GPU straight to each model input size
+        buffers = {
+            shape: np.empty(_padded(shape), dtype=np.uint8) for shape in self.shapes
+        }
+
+        if self.streaming:
+            self._stream(camera, image_format, size, options, buffers)
+            camera.close()
+            return
 
         while True:
             try:  # Timeout raises queue.Empty
                 file_path = self.file_queue.get(block=True, timeout=0.1)
 
                 logger.debug("Capturing image")
-                camera.capture(file_path, resize=(240, 240))
+                camera.capture(file_path, image_format, size, options)
+                self.capture_time.value = time.time()
+
+                self.file_queue.task_done()
+
+            except Empty:
+                if self.quit_event.is_set():
+                    logger.debug("Quitting camera thread...")
+                    break
+
+        camera.close()
+
+    def _stream(self, camera, image_format, size, options, buffers):
+        """Capture continuously from the video port, save the latest frame on request"""
+
+        lock = Lock()
+        ready = [ThreadEvent() for _ in range(1 + len(buffers))]
+        latest = {"image": None, "time": 0.0}
+
+        def _capture():
+            stream = io.BytesIO()
+            for _ in camera.capture_continuous(stream, image_format, size, options):
+                with lock:
+                    latest["image"] = stream.getvalue()
+                    latest["time"] = time.time()
+                ready[0].set()
+
+                stream.seek(0)
+                stream.truncate()
+
+                if self.quit_event.is_set():
+                    break
+
+        def _capture_rgb(shape, buffer, port, event):
+            # One splitter port per model input size
+            height, width, _ = shape
+            incoming = np.empty_like(buffer)
+            for _ in camera.capture_continuous_rgb(incoming, width, height, port):
+                with lock:
+                    buffer[:] = incoming
+                event.set()
+
+                if self.quit_event.is_set():
+                    break
+
+        threads = [Thread(target=_capture, name="capture", daemon=True)]
+        for (shape, buffer), port, event in zip(
+            buffers.items(), MODEL_PORTS, ready[1:]
+        ):
+            threads.append(
+                Thread(
+                    target=_capture_rgb,
+                    args=(shape, buffer, port, event),
+                    name="capture_rgb_%d" % (port),
+                    daemon=True,
+                )
+            )
+        for thread in threads:
+            thread.start()
+
+        while True:
+            try:  # Timeout raises queue.Empty
+                file_path = self.file_queue.get(block=True, timeout=0.1)
+
+                logger.debug("Saving latest streamed image")
+
+                # A capture thread that died would otherwise hold join() forever
+                stalled = [
+                    thread.name
+                    for thread, event in zip(threads, ready)
+                    if not event.wait(CAPTURE_TIMEOUT) or not thread.is_alive()
+                ]
+                if stalled:
+                    logger.error(
+                        "Camera streams %s stopped, skipping %s" % (stalled, file_path)
+                    )
+                    self.file_queue.task_done()
+                    continue
+
+                with lock:
+                    image = latest["image"]
+                    capture_time = latest["time"]
+                    for shape, buffer in buffers.items():
+                        height, width, _ = shape
+                        self.rings[shape].publish(buffer[:height, :width])
+
+                with open(file_path, "wb") as file:
+                    file.write(image)
+                self.capture_time.value = capture_time
 
                 self.file_queue.task_done()
 
@@ -40,6 +204,25 @@ class Camera(object):
                     logger.debug("Quitting camera thread...")
                     break
 
+        for thread in threads:
+            thread.join()
+
+    def get_capture_time(self):
+        """Returns capture time of the latest saved image (seconds since epoch)"""
+        return self.capture_time.value
+
+    def get_frames(self):
+        """Returns copies of the RGB frames published with the latest saved image
+
+        Keyed by (height, width, channels), one entry per model input size.
+        """
+        frames = {}
+        for shape, ring in self.rings.items():
+            latest = ring.latest()
+            if latest is not None:
+                frames[shape] = latest[2]
+        return frames
+
     def start(self, file_path):
         logger.debug("Calling start")
         self.file_queue.put(file_path, block=True)
@@ -56,3 +239,5 @@ class Camera(object):
     def quit(self):
         self.quit_event.set()
         self.p.join()
+        for ring in self.rings.values():
+            ring.close()
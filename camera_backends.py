@@ -0,0 +1,197 @@
+from abc import ABC, abstractmethod
+from threading import Lock
+from os import path, walk
+import time
+import numpy as np
+
+from PIL import Image
+
+from encoder import FORMATS
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+SYNTHETIC_SIZE = (640, 480)
+
+
+class PiCameraBackend(object):
+    """Raspberry Pi camera, all resizing and encoding happens on the GPU"""
+
+    def __init__(self):
+
+        from picamera import PiCamera
+
+        camera = PiCamera()
+        camera.rotation = 180
+        camera.zoom = (0.05, 0.0, 0.75, 0.95)
+        camera.resolution = (1024, 768)
+        self.camera = camera
+
+    def capture(self, output, image_format, size, options):
+        self.camera.capture(output, format=image_format, resize=(size, size), **options)
+
+    def capture_continuous(self, output, image_format, size, options):
+        return self.camera.capture_continuous(
+            output,
+            format=image_format,
+            use_video_port=True,
+            resize=(size, size),
+            **options
+        )
+
+    def capture_continuous_rgb(self, buffer, width, height, splitter_port):
+        return self.camera.capture_continuous(
+            buffer,
+            format="rgb",
+            use_video_port=True,
+            resize=(width, height),
+            splitter_port=splitter_port,
+        )
+
+    def close(self):
+        self.camera.close()
+
+
+class SoftwareBackend(ABC):
+    """Base for sources generated on the CPU, paced to `rate` frames per second
+
+    Subclasses implement `_frame(index)` returning a PIL RGB image. Continuous
+    captures on every port share one clock so they see the same frame, and
+    triggered captures step one frame per request like the real camera.
+    """
+
+    def __init__(self, rate):
+
+        self.rate = rate
+        self.lock = Lock()
+        self.start_time = time.monotonic()
+        self.index = -1
+        self.cached = (None, None)
+
+    @abstractmethod
+    def _frame(self, index):
+        """PIL RGB image for frame `index`"""
+
+    def _image(self, index):
+        with self.lock:
+            cached_index, image = self.cached
+            if cached_index != index:
+                image = self._frame(index)
+                self.cached = (index, image)
+            return image
+
+    def _ticks(self):
+        """Yield the frame index at each tick of the source clock"""
+        while True:
+            index = int((time.monotonic() - self.start_time) * self.rate) + 1
+            time.sleep(max(0, self.start_time + index / self.rate - time.monotonic()))
+            yield index
+
+    @staticmethod
+    def _save(image, output, image_format, size, options):
+        image = image.resize((size, size), Image.BILINEAR)
+        image.save(output, FORMATS[image_format][0], **options)
+
+    @staticmethod
+    def _fill(image, buffer, width, height):
+        buffer[:height, :width] = np.asarray(
+            image.resize((width, height), Image.BILINEAR)
+        )
+
+    def capture(self, output, image_format, size, options):
+        self.index += 1
+        self._save(self._image(self.index), output, image_format, size, options)
+
+    def capture_continuous(self, output, image_format, size, options):
+        for index in self._ticks():
+            self._save(self._image(index), output, image_format, size, options)
+            yield output
+
+    def capture_continuous_rgb(self, buffer, width, height, splitter_port):
+        for index in self._ticks():
+            self._fill(self._image(index), buffer, width, height)
+            yield buffer
+
+    def close(self):
+        pass
+
+
+class ReplayBackend(SoftwareBackend):
+    """Replay the images of a recorded session's `camera/` folder in order"""
+
+    def __init__(self, directory, rate):
+
+        super().__init__(rate)
+
+        files = []
+        for root, _, names in walk(directory):
+            for name in names:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(path.join(root, name))
+
+        if not files:
+            raise FileNotFoundError("No images found in %s" % (directory))
+
+        # Label subfolders are merged, names sort by measurement_ID
+        self.files = sorted(files, key=path.basename)
+        logger.info("Replaying %d images from %s" % (len(self.files), directory))
+
+    def _frame(self, index):
+        # Loop back to the start once the session has been played through
+        with Image.open(self.files[index % len(self.files)]) as image:
+            return image.convert("RGB")
+
+
+class SyntheticBackend(SoftwareBackend):
+    """Generate a pan on a hob with slowly changing contents and sensor noise"""
+
+    def __init__(self, rate, size=SYNTHETIC_SIZE, seed=0):
+
+        super().__init__(rate)
+
+        self.seed = seed
+        width, height = size
+        y, x = np.mgrid[0:height, 0:width]
+        radius = np.hypot(x - width / 2, y - height / 2)
+
+        self.pan = radius < min(width, height) * 0.4
+        self.rim = self.pan & (radius > min(width, height) * 0.36)
+        self.texture = np.sin(x / 7.0) * np.cos(y / 11.0)
+
+    def _frame(self, index):
+        rng = np.random.default_rng(self.seed + index)
+
+        phase = index / 50.0
+        frame = np.empty(self.pan.shape + (3,), dtype=np.float32)
+        frame[:] = (60, 55, 50)  # Hob
+        frame[self.pan] = (
+            120 + 60 * np.sin(phase),
+            100 + 40 * np.sin(phase + 1),
+            80 + 20 * np.sin(phase + 2),
+        )
+        frame[self.rim] = (40, 40, 45)
+        frame += 20 * self.texture[..., None] * np.sin(phase * 3)
+        frame += rng.normal(0, 4, frame.shape)
+
+        return Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8), "RGB")
+
+
+def open_backend(settings):
+    """Open the camera source named by the `camera_backend` setting"""
+
+    name = settings.get_setting("camera_backend")
+    if name == "picamera":
+        return PiCameraBackend()
+    elif name == "replay":
+        return ReplayBackend(
+            settings.get_setting("camera_replay_path"),
+            settings.get_setting("camera_source_rate"),
+        )
+    elif name == "synthetic":
+        return SyntheticBackend(settings.get_setting("camera_source_rate"))
+    else:
+        raise ValueError("Unknown camera_backend %s" % (name))
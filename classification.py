@@ -1,35 +1,348 @@
-from edgetpu.classification.engine import ClassificationEngine
-from edgetpu.utils import dataset_utils
-from PIL import Image
-from threading import Thread, Event
-from queue import Queue, Empty
-
-from config import Classifiers
+from threading import Thread, Event, Lock
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, PriorityQueue, Empty
+from itertools import count
+from os import path
+import time
+import numpy as np
+
+from inference import check_backend, open_engine, read_labels
+from preprocess import MODALITIES, SOURCES, Preprocessor
+from smoothing import ConfidenceAverage
+from scene_change import SceneGate
+from scheduler import Scheduler
+from latency import LatencyStats
+from result_cache import ResultCache, file_hash, frame_hash
+from config import Settings, Classifiers
 from json import dumps
-from collections import deque
+from collections import OrderedDict
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+settings = Settings()
 classifiers = Classifiers()
 
+TOP_K = 3
+
+# Load order, models asked for by set_classifiers jump ahead of preloading
+REQUESTED = 0
+PRELOAD = 1
+
 
 class Classify(object):
-    """Classify images with TensorFlow and the Coral Edge TPU (threaded)"""
+    """Classify images with TensorFlow Lite on the Coral Edge TPU or CPU (threaded)"""
 
     def __init__(self):
 
         logger.info("Initialising classifier...")
 
         self.library = classifiers.get_classifiers()
-        self.loaded = {}
         self.active = []
 
+        # Least recently used first, evicted once the cache exceeds its cap
+        self.loaded = OrderedDict()
+        self.cache_bytes = settings.get_setting("classifier_cache_mb") * 1024 * 1024
+        self.preload = settings.get_setting("classifier_preload")
+        self.lock = Lock()
+        self.load_queue = PriorityQueue()
+        self.load_order = count()
+
         self.quit_event = Event()
         self.file_queue = Queue()
         self.database = {}
 
+        # Moving average state per classifier, over the last `window` frames
+        self.averages = {}
+        self.window = settings.get_setting("classifier_window")
+
+        # Reuse the last results while a model's inputs are unchanged
+        self.gates = {}
+        if settings.get_setting("scene_gating"):
+            for source in ("camera", "thermal"):
+                self.gates[source] = SceneGate(
+                    threshold=settings.get_setting("scene_change_threshold"),
+                    max_stale=settings.get_setting("scene_max_stale"),
+                )
+        self.previous = {}
+        self.stale = set()  # Models whose inputs changed since they last ran
+
+        # Results of earlier runs on identical inputs, None disables the cache
+        cache_path = settings.get_setting("result_cache_path")
+        if cache_path:
+            self.results = ResultCache(
+                path.join(path.dirname(path.abspath(__file__)), cache_path),
+                max_entries=settings.get_setting("result_cache_entries"),
+            )
+        else:
+            self.results = None
+
+        # Timing of every stage, kept in fixed buckets
+        self.latency = LatencyStats(self.library)
+
+        # Each classifier runs at its own rate, low priority work is dropped first
+        self.scheduler = Scheduler(budget=settings.get_setting("classify_budget"))
+        for name, attr in self.library.items():
+            self.scheduler.configure(
+                name, rate=attr.get("rate", 0), priority=attr.get("priority", 0)
+            )
+
+        # Independent models run side by side, a single worker runs them in turn
+        self.workers = settings.get_setting("classify_workers")
+
+    def _infer(self, model, tensor):
+        """Run one model, returns its top 3 (label index, probability) results
+
+        Returned with the time the run took, for the scheduler's cost estimate.
+        """
+        start = time.monotonic()
+        results = model.classify(tensor, top_k=TOP_K)
+        return results, time.monotonic() - start
+
+    def _load(self, name):
+        """Load and warm up one classifier, returns its cache entry"""
+
+        logger.debug("Loading classifier %s " % (name))
+
+        # Read attributes from library and initialise
+        try:
+            attr = self.library[name]
+            output = {}
+            output["labels"] = read_labels(attr["labels"])
+            output["model"] = open_engine(attr)
+            output["input_shape"] = output["model"].input_shape
+            output["input_dtype"] = output["model"].input_dtype
+            output["thresholds"] = attr["thresholds"]
+            output["modality"] = attr.get("input", "camera")
+            output["size"] = path.getsize(attr["model"])
+            output["hash"] = file_hash(attr["model"]) if self.results else None
+        except KeyError:
+            raise KeyError("Classifier name not found in database")
+        except FileNotFoundError:
+            raise FileNotFoundError("Model or labels not found in models folder")
+
+        if output["modality"] not in MODALITIES:
+            raise ValueError("Unknown input modality %s" % (output["modality"]))
+
+        # Pay first inference costs (allocation, delegate setup) before going live
+        warm_up = np.zeros(
+            int(np.prod(output["input_shape"])), dtype=output["input_dtype"]
+        )
+        output["model"].classify(warm_up, top_k=1)
+
+        return output
+
+    def _cache(self, name, output):
+        """Add a loaded classifier, evicting the least recently used over the cap"""
+
+        with self.lock:
+            self.loaded[name] = output
+            self.loaded.move_to_end(name)
+
+            total = sum(entry["size"] for entry in self.loaded.values())
+            for old in list(self.loaded):
+                if total <= self.cache_bytes:
+                    break
+                if old in self.active or old == name:
+                    continue
+                total -= self.loaded.pop(old)["size"]
+                logger.info("Evicted classifier %s from cache" % (old))
+
+    def _fits(self, name):
+        """Whether a classifier can be loaded without evicting another"""
+        try:
+            size = path.getsize(self.library[name]["model"])
+        except OSError:
+            return False
+        with self.lock:
+            total = sum(entry["size"] for entry in self.loaded.values())
+        return total + size <= self.cache_bytes
+
+    def _loader(self):
+
+        logger.debug("Initialising classifier loader")
+
+        while True:
+            try:  # Timeout raises queue.Empty
+                priority, _, name = self.load_queue.get(block=True, timeout=0.1)
+
+            except Empty:
+                if self.quit_event.is_set():
+                    logger.debug("Quitting loader thread...")
+                    break
+
+            else:
+                try:
+                    if priority == PRELOAD and not self._fits(name):
+                        logger.debug("Cache full, not preloading %s" % (name))
+                    elif name not in self.loaded:
+                        self._cache(name, self._load(name))
+                        logger.info("Classifier %s ready" % (name))
+                except Exception as error:
+                    # A missing backend or device must not stop later loads
+                    logger.error("Failed to load classifier %s: %s" % (name, error))
+                finally:
+                    self.load_queue.task_done()
+
+    def _classify(self, file_path, frames, thermal, queued):
+        """Classify one frame with every active model and update the database"""
+
+        latency = self.latency
+        latency.queue_wait.record(time.monotonic() - queued)
+
+        # Inputs are shared by models with the same modality, shape and dtype
+        preprocessor = Preprocessor(file_path, frames, thermal)
+
+        library = self.library
+        active = self.active
+        database = self.database
+        averages = self.averages
+
+        # Snapshot the active models that have finished loading
+        with self.lock:
+            models = {}
+            for name in active:
+                if name in self.loaded:
+                    self.loaded.move_to_end(name)
+                    models[name] = self.loaded[name]
+
+        # Which inputs have changed since they were last classified
+        now = time.monotonic()
+        changed = {}
+        needed = set()
+        for model in models.values():
+            needed.update(SOURCES[model["modality"]])
+        for source, gate in self.gates.items():
+            if source in needed and preprocessor.available(source):
+                thumbnail = preprocessor.thumbnail(source=source)
+                changed[source] = gate.changed(thumbnail)
+
+        # Held until the model runs, so a deferral cannot hide the change
+        for name, model in models.items():
+            if any(changed.get(s) for s in SOURCES[model["modality"]]):
+                self.stale.add(name)
+
+        # Skip models whose last result is recent enough for their inputs
+        reused = {}
+        gated = set()
+        for name, model in models.items():
+            if name not in self.previous:
+                continue
+            results, stamp = self.previous[name]
+            sources = SOURCES[model["modality"]]
+            if not preprocessor.available(model["modality"]):
+                # Nothing to classify this frame, hold the last result
+                reused[name] = results
+            elif self.gates and name not in self.stale:
+                if self.gates[sources[0]].fresh(stamp, now):
+                    reused[name] = results
+                    gated.add(name)
+
+        # Models not due or over budget reuse their last results too
+        candidates = [
+            name
+            for name in library
+            if name in models
+            and name not in reused
+            and preprocessor.available(models[name]["modality"])
+        ]
+        run, deferred = self.scheduler.select(candidates, now)
+        for name in deferred:
+            if name in self.previous:
+                reused[name] = self.previous[name][0]
+
+        # Start every active model before collecting any results
+        pending = {}
+        hits = {}
+        keys = {}
+        for name in run:
+            start = time.monotonic()
+            tensor = preprocessor.tensor(
+                models[name]["input_shape"],
+                models[name]["input_dtype"],
+                models[name]["modality"],
+            )
+            latency.record(name, "preprocess", time.monotonic() - start)
+
+            # Same model on the same input, no need to run it again
+            if self.results is not None:
+                keys[name] = frame_hash(tensor)
+                model_hash = models[name]["hash"]
+                cached = self.results.get(model_hash, keys[name], TOP_K)
+                if cached is not None:
+                    hits[name] = cached
+                    continue
+
+            logger.debug("Starting classifier %s " % (name))
+            pending[name] = self.pool.submit(
+                self._infer, models[name]["model"], tensor
+            )
+
+        # Count only runs actually started and reuse the gate decided, once per
+        # model under the input that sets its staleness
+        for name, model in models.items():
+            source = SOURCES[model["modality"]][0]
+            if source in self.gates:
+                self.gates[source].record(int(name in pending), int(name in gated))
+
+        # Merge in library order so the database is the same either way
+        for name in library:
+
+            # Remove classifiers in database that are not active
+            if name not in models:
+                if name in database:
+                    del database[name]
+                    averages.pop(name, None)
+                    self.previous.pop(name, None)
+                self.stale.discard(name)
+                continue
+
+            if name in reused:
+                # Still fed to the moving average so it keeps decaying
+                results = reused[name]
+            elif name in hits:
+                results = hits[name]
+                self.previous[name] = (results, now)
+                self.stale.discard(name)
+                self.scheduler.record(name, now)
+            elif name in pending:
+                try:
+                    results, duration = pending[name].result()
+                    logger.debug("%s results: " % (results))
+                except Exception as error:
+                    logger.error("Classifier %s failed, skipping: %s" % (name, error))
+                    continue
+                self.previous[name] = (results, now)
+                self.stale.discard(name)
+                self.scheduler.record(name, now, duration)
+                latency.record(name, "invoke", duration)
+                if self.results is not None:
+                    self.results.put(
+                        models[name]["hash"], keys[name], TOP_K, results
+                    )
+            else:
+                # Deferred before it has ever run
+                continue
+
+            # Ensure classifier has moving average state
+            try:
+                average = averages[name]
+            except KeyError:
+                average = ConfidenceAverage(
+                    models[name]["labels"],
+                    models[name]["thresholds"],
+                    window=self.window,
+                )
+                averages[name] = average
+
+            # Update database with all information from this classifier
+            start = time.monotonic()
+            database[name] = average.update(results)
+            latency.record(name, "postprocess", time.monotonic() - start)
+
+        self.database = database
+
     def _worker(self):
 
         logger.debug("Initialising classification worker")
@@ -37,7 +350,9 @@ class Classify(object):
         while True:
             try:  # Timeout raises queue.Empty
 
-                image = self.file_queue.get(block=True, timeout=0.1)
+                file_path, frames, thermal, queued = self.file_queue.get(
+                    block=True, timeout=0.1
+                )
 
             except Empty:
                 if self.quit_event.is_set():
@@ -45,128 +360,73 @@ class Classify(object):
                     break
 
             else:
-                image = Image.open(image)
-
-                library = self.library
-                active = self.active
-                database = self.database
-
-                # Iterate over all classifiers
-                for name in library:
-
-                    # Only classify active classifiers
-                    if name in active:
-
-                        # Ensure classifer is in database
-                        try:
-                            storage = database[name]
-                        except KeyError:
-                            storage = {}
-
-                        # Load classifier information
-                        engine = self.loaded[name]["model"]
-                        labels = self.loaded[name]["labels"]
-                        thresholds = self.loaded[name]["thresholds"]
-
-                        # Run inference
-                        logger.debug("Starting classifier %s " % (name))
-
-                        try:
-                            results = engine.classify_with_image(
-                                image, top_k=3, threshold=0
-                            )  # Return top 3 probability items
-                            logger.debug("%s results: " % (results))
-                        except OSError:
-                            logger.info("OSError detected, retrying")
-                            break
-
-                        # Create dictionary including those not in top_k
-                        big_dict = {}
-                        for result in results:
-                            label = labels[result[0]]
-                            confidence = round(result[1].item(), 2)
-                            big_dict[label] = confidence
-
-                        not_in_top_k = big_dict.keys() ^ labels.values()
-                        for label in not_in_top_k:
-                            # Zero confidence ensures moving average keeps moving
-                            big_dict[label] = 0
-
-                        # Iterate over the dictionary
-                        for label, confidence in big_dict.items():
-
-                            # Ensure label is in classifier storage entry
-                            if label not in storage:
-                                storage[label] = {}
-                                storage[label]["queue"] = [0] * 5
-
-                            # Update nested storage dictionary
-                            this_label = storage[label]
-                            this_label["confidence"] = confidence
-
-                            # Use deque to update moving average
-                            queue = deque(this_label["queue"])
-                            queue.append(confidence)
-                            queue.popleft()
-                            this_label["queue"] = list(queue)
-                            average = round(sum(queue) / 5, 2)
-                            this_label["average"] = average
-
-                            # Use threshold storage to check whether it exceeds
-                            this_label["threshold"] = thresholds[label]
-                            this_label["boolean"] = average >= thresholds[label]
-
-                        # Update database with all information from this classifier
-                        database[name] = storage
-
-                    # Remove classifiers in database that are not active
-                    elif name in database:
-                        del database[name]
-
-                self.database = database
-
-                self.file_queue.task_done()
+                try:
+                    self._classify(file_path, frames, thermal, queued)
+                except Exception as error:
+                    # Skip the frame, join() must still return
+                    logger.error("Classification failed, skipping frame: %s" % (error))
+                finally:
+                    self.file_queue.task_done()
 
     def load_classifiers(self, input_string):
+        """Load classifiers now, blocking until they are ready"""
         for name in input_string.split(","):
 
             # Check if classifier has already been loaded
             if name not in self.loaded:
-                logger.debug("Loading classifier %s " % (name))
-
-                # Read attributes from library and initialise
-                try:
-                    attr = self.library[name]
-                    output = {}
-                    output["labels"] = dataset_utils.read_label_file(attr["labels"])
-                    output["model"] = ClassificationEngine(attr["model"])
-                    output["thresholds"] = attr["thresholds"]
-                    self.loaded[name] = output
-                except KeyError:
-                    raise KeyError("Classifier name not found in database")
-                except FileNotFoundError:
-                    raise FileNotFoundError(
-                        "Model or labels not found in models folder"
-                    )
+                self._cache(name, self._load(name))
 
             else:
                 logger.debug("Classifier already loaded %s " % (name))
 
     def set_classifiers(self, input_string):
-        for name in input_string.split(","):
+        """Swap the active classifiers, any not yet loaded join once ready"""
+        names = input_string.split(",")
+        for name in names:
+            if name not in self.library:
+                raise KeyError("Classifier name not found in database")
+            if name not in self.loaded:
+                check_backend(self.library[name])
 
+        for name in names:
             # Check if classifier has already been loaded
             if name not in self.loaded:
-                logger.debug("Classifier not loaded %s: loading " % (name))
-                self.load_classifiers(name)
-        self.active = input_string.split(",")
+                logger.debug("Classifier not loaded %s: queued " % (name))
+                self.load_queue.put((REQUESTED, next(self.load_order), name))
+        self.active = names
 
     def get_classifiers(self):
         return dumps(self.library)
 
-    def start(self, file_path):
+    def get_classifier_rates(self):
+        """Returns target and achieved runs per second of each classifier"""
+        return self.scheduler.get_rates()
+
+    def get_latency(self):
+        """Returns queue wait and per classifier stage latency histograms"""
+        return dumps(self.latency.get_summary())
+
+    def get_cache_stats(self):
+        """Returns result cache entries, hits and misses"""
+        if self.results is None:
+            return None
+        return self.results.get_stats()
+
+    def get_gating_stats(self):
+        """Returns how many model runs scene change gating has skipped, per input"""
+        if not self.gates:
+            return None
+        return {source: gate.get_stats() for source, gate in self.gates.items()}
+
+    def start(self, file_path, frames=None, thermal=None):
+        """Queue an image for classification
+
+        `frames` optionally maps (height, width, channels) to RGB arrays already
+        at model input size, the file is only decoded for inputs without one.
+        `thermal` is the matching temperature frame for thermal and fused models.
+        """
         logger.debug("Calling start")
-        self.file_queue.put(file_path)
+        self.file_queue.put((file_path, frames or {}, thermal, time.monotonic()))
 
     def join(self):
         logger.debug("Calling join")
@@ -174,10 +434,23 @@ class Classify(object):
 
     def launch(self):
         logger.debug("Initialising classification worker")
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="classify"
+        )
         self.thread = Thread(target=self._worker, daemon=True)
         self.thread.start()
 
+        self.loader = Thread(target=self._loader, daemon=True)
+        self.loader.start()
+        if self.preload:
+            for name in self.library:
+                self.load_queue.put((PRELOAD, next(self.load_order), name))
+
     def quit(self):
         self.quit_event.set()
         logger.debug("Waiting for classification thread to finish")
         self.thread.join()
+        self.loader.join()
+        self.pool.shutdown(wait=True)
+        if self.results is not None:
+            self.results.close()
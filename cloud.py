@@ -1,6 +1,9 @@
 from os import environ, path
+from google.auth import default
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
-from threading import Thread, Event
+from requests.adapters import HTTPAdapter
+from threading import Thread, Event, Semaphore
 from queue import Queue, Empty
 
 import logging
@@ -12,94 +15,124 @@ environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/home/pi/onionbot-819a387e4e79.json
 BUCKET = "onion_bucket"
 PATH = path.dirname(__file__)
 
+WORKERS = 8
+FILE_TYPES = ("camera", "thermal", "labels")
+PUBLIC_ROLE = "roles/storage.objectViewer"
+
 
 class Cloud(object):
-    """Upload images to Google Cloud storage buckets (threaded)"""
+    """Upload files to Google Cloud storage buckets (threaded)
+
+    A pool of `workers` threads shares one storage client and its HTTP
+    connection pool, so uploads overlap rather than waiting on each other's
+    round trips. Each file type has its own queue and can be joined on its
+    own. With `public_bucket`, a bucket that already grants public read is
+    used as is, otherwise each object is made public in its upload request.
+    The bucket's IAM policy is never changed from here.
+    """
 
-    def __init__(self):
+    def __init__(self, workers=WORKERS, public_bucket=True):
 
         logger.info("Initialising cloud upload...")
 
+        self.workers = workers
+        self.public_bucket = public_bucket
         self.quit_event = Event()
-        self.thermal_file_queue = Queue()
-        self.camera_file_queue = Queue()
+        self.queues = {file_type: Queue() for file_type in FILE_TYPES}
+        self.pending = Semaphore(0)  # Files queued but not yet taken by a worker
         self.bucket = BUCKET
 
-    def _camera_worker(self):
+    def _client(self):
+        """Storage client with a connection for every worker"""
 
-        logger.debug("Initialising upload worker for camera")
+        # The client only adds its scopes to sessions it builds itself
+        credentials, project = default(scopes=storage.Client.SCOPE)
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount("https://", adapter)
+        return storage.Client(project=project, credentials=credentials, _http=session)
 
-        client = storage.Client()
-        bucket = client.get_bucket(BUCKET)
-
-        while True:
-            try:  # Timeout raises queue.Empty
-                local_path = self.camera_file_queue.get(block=True, timeout=0.1)
-                cloud_path = local_path.replace(PATH + "/" + BUCKET + "/", "")
+    def _is_public(self, bucket):
+        """Whether the bucket already grants public read to everyone"""
 
-                blob = bucket.blob(cloud_path)
-                blob.upload_from_filename(local_path)
-                blob.make_public()
-                logger.debug("Uploaded camera file to cloud: %s" % (local_path))
-                logger.debug("Blob is publicly accessible at %s" % (blob.public_url))
+        try:
+            policy = bucket.get_iam_policy(requested_policy_version=3)
+        except Exception as e:  # Also raised offline, when the token cannot refresh
+            logger.warning("Cannot read bucket policy, using object ACLs: %s" % (e))
+            return False
 
-                self.camera_file_queue.task_done()
-
-            except Empty:
-                if self.quit_event.is_set():
-                    logger.debug("Quitting camera camera thread...")
-                    break
+        for binding in policy.bindings:
+            if binding["role"] == PUBLIC_ROLE and "allUsers" in binding["members"]:
+                return True
 
-    def start_camera(self, file_path):
-        logger.debug("Calling start for camera")
-        self.camera_file_queue.put(file_path)
+        logger.info("Bucket %s is not public, using object ACLs" % (bucket.name))
+        return False
 
-    def join_camera(self):
-        logger.debug("Calling join for camera")
-        self.camera_file_queue.join()
+    def _upload(self, file_type, local_path):
+        cloud_path = local_path.replace(PATH + "/" + BUCKET + "/", "")
 
-    def launch_camera(self):
-        logger.debug("Initialising worker for camera")
-        self.camera_thread = Thread(target=self._camera_worker, daemon=True)
-        self.camera_thread.start()
+        blob = self.bucket_handle.blob(cloud_path)
+        blob.upload_from_filename(local_path, predefined_acl=self.acl)
+        logger.debug("Uploaded %s file to cloud: %s" % (file_type, local_path))
+        logger.debug("Blob is publicly accessible at %s" % (blob.public_url))
 
-    def _thermal_worker(self):
+    def _worker(self, index):
 
-        logger.debug("Initialising upload worker for thermal")
+        logger.debug("Initialising upload worker %d" % (index))
 
-        client = storage.Client()
-        bucket = client.get_bucket(BUCKET)
+        # Start each worker on a different queue so no file type waits behind another
+        offset = index % len(FILE_TYPES)
+        file_types = FILE_TYPES[offset:] + FILE_TYPES[:offset]
 
         while True:
-            try:  # Timeout raises queue.Empty
-                local_path = self.thermal_file_queue.get(block=True, timeout=0.1)
-                cloud_path = local_path.replace(PATH + "/" + BUCKET + "/", "")
-
-                blob = bucket.blob(cloud_path)
-                blob.upload_from_filename(local_path)
-                blob.make_public()
-                logger.debug("Uploaded thermal file to cloud: %s" % (local_path))
-                logger.debug("Blob is publicly accessible at %s" % (blob.public_url))
-
-                self.thermal_file_queue.task_done()
-
-            except Empty:
+            # Each release is one queued file, so a later get cannot miss
+            if not self.pending.acquire(timeout=0.1):
                 if self.quit_event.is_set():
-                    logger.debug("Quitting thermal camera thread...")
+                    logger.debug("Quitting upload worker %d..." % (index))
                     break
+                continue
 
-    def start_thermal(self, file_path):
-        logger.debug("Calling start for thermal")
-        self.thermal_file_queue.put(file_path)
-
-    def join_thermal(self):
-        logger.debug("Calling join for thermal")
-        self.thermal_file_queue.join()
+            for file_type in file_types:
+                try:
+                    local_path = self.queues[file_type].get_nowait()
+                    break
+                except Empty:
+                    pass
+
+            try:
+                self._upload(file_type, local_path)
+            except Exception as e:
+                # Includes auth transport errors when the network drops
+                logger.error("Failed to upload %s: %s" % (local_path, e))
+            finally:
+                self.queues[file_type].task_done()
+
+    def start(self, file_path, file_type="camera"):
+        logger.debug("Calling start for %s upload" % (file_type))
+        self.queues[file_type].put(file_path)
+        self.pending.release()
+
+    def join(self, file_type=None):
+        """Wait for uploads of one file type, or of every type if None"""
+        logger.debug("Calling join for %s upload" % (file_type or "all"))
+        for name in FILE_TYPES if file_type is None else (file_type,):
+            self.queues[name].join()
+
+    def launch(self):
+        logger.debug("Initialising %d upload workers" % (self.workers))
+
+        client = self._client()
+        self.bucket_handle = client.bucket(BUCKET)
+        if self.public_bucket and self._is_public(self.bucket_handle):
+            self.acl = None
+        else:
+            self.acl = "publicRead"
 
-    def launch_thermal(self):
-        logger.debug("Initialising worker for thermal")
-        self.thermal_thread = Thread(target=self._thermal_worker, daemon=True)
-        self.thermal_thread.start()
+        self.threads = []
+        for index in range(self.workers):
+            thread = Thread(target=self._worker, args=(index,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
 
     def get_public_path(self, local_path):
         if local_path:
@@ -112,7 +145,6 @@ class Cloud(object):
 
     def quit(self):
         self.quit_event.set()
-        logger.debug("Waiting for camera cloud thread to finish uploading")
-        self.camera_thread.join()
-        logger.debug("Waiting for thermal cloud thread to finish uploading")
-        self.thermal_thread.join()
+        logger.debug("Waiting for cloud threads to finish uploading")
+        for thread in self.threads:
+            thread.join()
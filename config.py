@@ -2,6 +2,8 @@ from json import dumps, dump, load
 
 FILE = "/home/pi/onionbot/config.json"
 
+DEFAULT_INPUT_SHAPE = (224, 224, 3)
+
 
 class Settings(object):
     """Interface with the `config.json` settings dictionary"""
@@ -56,3 +58,20 @@ class Classifiers(object):
             config = load(json_data_file)
             classifiers = config["classifiers"]
             return classifiers
+
+    def get_input_shape(self, name):
+        """Returns (height, width, channels) from the model's `metadata` file"""
+
+        attr = self.get_classifiers()[name]
+        try:
+            metadata_path = attr["metadata"]
+        except KeyError:
+            return DEFAULT_INPUT_SHAPE
+
+        with open(metadata_path) as json_data_file:
+            metadata = load(json_data_file)
+            return (
+                metadata["imageHeight"],
+                metadata["imageWidth"],
+                metadata["imageChannels"],
+            )
@@ -35,6 +35,7 @@ class Control(object):
         self.quit_event = Event()
 
         self.temperature = 0
+        self.temperature_source = None
 
         self.fixed_setpoint = 0
         self.temperature_target = None
@@ -62,6 +63,12 @@ class Control(object):
     def _worker(self):
 
         while True:
+            # Follow the sensor between frames when a live source is available
+            if self.temperature_source is not None:
+                temperature = self.temperature_source()
+                if temperature is not None:
+                    self.temperature = temperature
+
             current_setpoint = knob.get_achieved()
 
             if pid.is_enabled:
@@ -85,6 +92,10 @@ class Control(object):
         self.thread = Thread(target=self._worker, daemon=True)
         self.thread.start()
 
+    def set_temperature_source(self, source):
+        """Callable returning the latest temperature, polled by the PID loop"""
+        self.temperature_source = source
+
     def update_fixed_setpoint(self, setpoint):
         logger.debug("Updating fixed setpoint to %s/100 " % (setpoint))
         self.fixed_setpoint = float(setpoint)
@@ -137,7 +148,9 @@ class Control(object):
         """NOTE: Must be called only ONCE per frame for history to stay in sync with thermal"""
         logger.debug("Refresh called")
 
-        self.temperature = float(temperature)
+        # A live source is newer than the main loop's snapshot, keep its reading
+        if self.temperature_source is None:
+            self.temperature = float(temperature)
 
         setpoint = round(knob.get_setpoint())
         logger.debug("Servo get_setpoint returned %s " % (setpoint))
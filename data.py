@@ -1,14 +1,19 @@
 from json import dump
 from cloud import Cloud
+from thermal_archive import ThermalArchive
+from encoder import extension
+from config import Settings
 from os import makedirs, path
 from datetime import datetime
 from collections import Counter
+from threading import Lock
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 cloud = Cloud()
+config = Settings()
 
 PATH = path.dirname(__file__)
 BUCKET = cloud.bucket
@@ -24,8 +29,14 @@ class Data:
         self.thermal_filepath = None
         self.thermal_history_filepath = None
         self.meta_filepath = None
+        self.thermal_archive = None
+        self.archive_session = None
+        self.archive_lock = Lock()  # Swapped by the API thread, appended by main
         self.timer = datetime.now()
 
+        self.camera_extension = extension(config.get_setting("camera_format"))
+        self.thermal_extension = extension(config.get_setting("thermal_format"))
+
     def start_session(self, session_ID):
 
         # Labels file creation
@@ -54,6 +65,30 @@ class Data:
         self.labels_file_path = labels_file_path
         self.label_count = label_count
 
+        # Raw thermal frames, appended to if the session is resumed
+        if session_ID == self.archive_session:
+            return
+        archive = ThermalArchive(f"{PATH}/{BUCKET}/{session_ID}/thermal_frames.bin")
+        with self.archive_lock:
+            previous = self.thermal_archive
+            self.thermal_archive = archive
+            self.archive_session = session_ID
+            if previous is not None:
+                previous.close()
+
+    def archive_thermal(self, session_ID, timer, measurement_ID, frame):
+        """Append the raw thermal frame to the session archive"""
+
+        if not session_ID or frame is None:
+            return
+
+        with self.archive_lock:
+            # A frame captured before a session switch belongs to the old session
+            if session_ID != self.archive_session:
+                logger.debug("No archive open for session %s" % (session_ID))
+                return
+            self.thermal_archive.append(timer.timestamp(), measurement_ID, frame)
+
     def generate_file_data(self, session_ID, timer, measurement_ID, label):
         """Generate file_data for local and cloud storage for all file types"""
 
@@ -63,7 +98,7 @@ class Data:
         # Camera filepath
         new_path = f"{PATH}/{BUCKET}/{session_ID}/camera/{label}"
         makedirs(new_path, exist_ok=True)
-        filename = f"{session_ID}_{str(measurement_ID).zfill(5)}_{time_stamp}_camera_{label}.jpg"
+        filename = f"{session_ID}_{str(measurement_ID).zfill(5)}_{time_stamp}_camera_{label}.{self.camera_extension}"
         file_data["camera_file"] = f"{new_path}/{filename}"
 
         if not session_ID:
@@ -92,7 +127,7 @@ class Data:
         # Thermal filepath
         new_path = f"{PATH}/{BUCKET}/{session_ID}/thermal/{label}"
         makedirs(new_path, exist_ok=True)
-        filename = f"{session_ID}_{str(measurement_ID).zfill(5)}_{time_stamp}_thermal_{label}.jpg"
+        filename = f"{session_ID}_{str(measurement_ID).zfill(5)}_{time_stamp}_thermal_{label}.{self.thermal_extension}"
         file_data["thermal_file"] = f"{new_path}/{filename}"
 
         # Meta filepath
@@ -138,6 +173,7 @@ class Data:
                 "thermal_filepath": thermal_filepath,
                 "temperature": thermal_data["temperature"],
                 "thermal_history": thermal_data["thermal_history"],
+                "pan_temperature": thermal_data["pan_temperature"],
                 "servo_setpoint": control_data["servo_setpoint"],
                 "servo_setpoint_history": control_data["servo_setpoint_history"],
                 "servo_achieved": control_data["servo_achieved"],
@@ -157,3 +193,20 @@ class Data:
             dump(data, write_file)
 
         return data
+
+    def set_capture_time(self, meta, file_data, capture_time):
+        """Add the camera's own capture time, only known once meta is written"""
+
+        time_stamp = datetime.fromtimestamp(capture_time)
+        meta["attributes"]["capture_time"] = time_stamp.strftime("%Y-%m-%d_%H-%M-%S-%f")
+
+        with open(file_data["meta"], "w") as write_file:
+            dump(meta, write_file)
+
+    def quit(self):
+        """Close the current session's thermal archive"""
+        with self.archive_lock:
+            if self.thermal_archive is not None:
+                self.thermal_archive.close()
+                self.thermal_archive = None
+                self.archive_session = None
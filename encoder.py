@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from threading import Lock
+
+from thermal_render import render
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Setting value: (PIL format, file extension)
+FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "png": ("PNG", "png"),
+    "webp": ("WEBP", "webp"),
+}
+
+
+def extension(image_format):
+    """File extension for a format setting"""
+    try:
+        return FORMATS[image_format][1]
+    except KeyError:
+        raise KeyError("Image format %s not supported" % (image_format))
+
+
+def _save(img, file_path, image_format, quality):
+    pil_format = FORMATS[image_format][0]
+    if pil_format == "PNG":
+        img.save(file_path, pil_format)
+    else:
+        img.save(file_path, pil_format, quality=quality)
+
+
+def encode_thermal(frame, file_path, image_format, quality, size):
+    """Render and save a thermal frame (module level so it pickles to a process pool)"""
+    _save(render(frame, size=(size, size)), file_path, image_format, quality)
+    return file_path
+
+
+class Encoder(object):
+    """Encode images on a small worker pool (threaded or multiprocessing)"""
+
+    def __init__(self, workers=2, use_process=False):
+
+        logger.info("Initialising image encoder...")
+
+        if use_process:
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="encoder"
+            )
+
+        self.lock = Lock()
+        self.pending = set()
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        if future.exception() is not None:
+            logger.info("Image encoding failed: %s" % (future.exception()))
+
+    def submit(self, function, *args):
+        future = self.pool.submit(function, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def join(self):
+        """Wait for every queued encode to be written"""
+        logger.debug("Calling join")
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+
+    def quit(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,109 @@
+from multiprocessing import shared_memory
+import time
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRing(object):
+    """Ring buffer of fixed shape frames in shared memory (lock free)
+
+    One process publishes, any number of processes read by attaching with the
+    same name. Each slot carries a sequence number which is invalidated while
+    the slot is being written, so readers can detect a torn copy and retry
+    instead of taking a lock. Nothing is pickled per frame.
+    """
+
+    def __init__(self, shape, dtype=np.float32, slots=8, name=None):
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        header_bytes = 8 * (1 + 2 * slots)  # head, slot sequences, slot stamps
+        size = header_bytes + frame_bytes * slots
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+
+        buf = self.shm.buf
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=0)
+        self._sequences = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=8)
+        self._stamps = np.ndarray(
+            (slots,), dtype=np.float64, buffer=buf, offset=8 * (1 + slots)
+        )
+        self._frames = np.ndarray(
+            (slots,) + self.shape, dtype=self.dtype, buffer=buf, offset=header_bytes
+        )
+
+        if self.owner:
+            self._head[0] = 0
+            self._sequences[:] = 0
+
+    def publish(self, frame, stamp=None):
+        """Copy a frame into the next slot and return its sequence number"""
+
+        sequence = int(self._head[0]) + 1
+        slot = sequence % self.slots
+
+        self._sequences[slot] = -1  # Mark slot as being written
+        self._frames[slot] = frame
+        self._stamps[slot] = time.monotonic() if stamp is None else stamp
+        self._sequences[slot] = sequence
+        self._head[0] = sequence
+
+        return sequence
+
+    @property
+    def sequence(self):
+        """Sequence number of the latest published frame, 0 if none yet"""
+        return int(self._head[0])
+
+    def read(self, sequence, out=None):
+        """Copy out a frame by sequence number, None if it has been overwritten"""
+
+        if sequence < 1:
+            return None
+
+        slot = sequence % self.slots
+        if self._sequences[slot] != sequence:
+            return None
+
+        stamp = float(self._stamps[slot])
+        if out is None:
+            frame = self._frames[slot].copy()
+        else:
+            np.copyto(out, self._frames[slot])
+            frame = out
+
+        # Slot was reused while copying
+        if self._sequences[slot] != sequence:
+            return None
+
+        return stamp, frame
+
+    def latest(self):
+        """Return (sequence, stamp, frame) for the newest frame, None if empty"""
+
+        while True:
+            sequence = self.sequence
+            if sequence == 0:
+                return None
+            result = self.read(sequence)
+            if result is not None:
+                return (sequence,) + result
+
+    def close(self):
+        # Drop array views before releasing the shared memory buffer
+        del self._head, self._sequences, self._stamps, self._frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
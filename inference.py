@@ -0,0 +1,112 @@
+import re
+from importlib.util import find_spec
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BACKEND = "edgetpu"
+DEFAULT_THREADS = 1
+
+# Package each backend imports when it opens a model
+PACKAGES = {"edgetpu": "edgetpu", "tflite": "tflite_runtime"}
+
+
+def read_labels(file_path):
+    """Read a labels file, either one label per line or `index label` pairs"""
+
+    with open(file_path) as file:
+        lines = [line.strip() for line in file if line.strip()]
+
+    labels = {}
+    for index, line in enumerate(lines):
+        pair = re.match(r"^(\d+)\s+(.+)$", line)
+        if pair:
+            labels[int(pair.group(1))] = pair.group(2)
+        else:
+            labels[index] = line
+    return labels
+
+
+class EdgeTPUEngine(object):
+    """Run a compiled model on the Coral Edge TPU"""
+
+    def __init__(self, model_path):
+
+        from edgetpu.classification.engine import ClassificationEngine
+
+        self.engine = ClassificationEngine(model_path)
+        shape = self.engine.get_input_tensor_shape()
+        self.input_shape = tuple(int(d) for d in shape[1:])
+        self.input_dtype = np.uint8  # Edge TPU models are quantized
+
+    def classify(self, tensor, top_k):
+        """Returns the top_k (label index, probability) pairs"""
+        results = self.engine.classify_with_input_tensor(
+            tensor, top_k=top_k, threshold=0
+        )
+        return [(index, float(score)) for index, score in results]
+
+
+class TFLiteEngine(object):
+    """Run a model on the CPU with the TensorFlow Lite interpreter"""
+
+    def __init__(self, model_path, num_threads=DEFAULT_THREADS):
+
+        from tflite_runtime.interpreter import Interpreter
+
+        self.interpreter = Interpreter(model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+
+        self.input_shape = tuple(int(d) for d in self.input_details["shape"][1:])
+        self.input_dtype = self.input_details["dtype"]
+
+    def classify(self, tensor, top_k):
+        """Returns the top_k (label index, probability) pairs"""
+
+        self.interpreter.set_tensor(
+            self.input_details["index"], tensor.reshape(self.input_details["shape"])
+        )
+        self.interpreter.invoke()
+        output = np.squeeze(self.interpreter.get_tensor(self.output_details["index"]))
+
+        # If the model is quantized (uint8 data), then dequantize the results
+        if self.output_details["dtype"] == np.uint8:
+            scale, zero_point = self.output_details["quantization"]
+            output = scale * (output.astype(np.float32) - zero_point)
+
+        top_k = min(top_k, output.size)
+        ordered = np.argpartition(-output, top_k - 1)[:top_k]
+        ordered = ordered[np.argsort(-output[ordered])]
+        return [(int(index), float(output[index])) for index in ordered]
+
+
+def check_backend(attr):
+    """Raise if a classifier's backend is unknown or its package is not installed"""
+
+    backend = attr.get("backend", DEFAULT_BACKEND)
+    try:
+        package = PACKAGES[backend]
+    except KeyError:
+        raise ValueError("Unknown classifier backend %s" % (backend))
+    if find_spec(package) is None:
+        raise ImportError("Classifier backend %s needs %s" % (backend, package))
+
+
+def open_engine(attr):
+    """Open the inference backend named by a classifier's `backend` entry"""
+
+    backend = attr.get("backend", DEFAULT_BACKEND)
+    if backend == "edgetpu":
+        return EdgeTPUEngine(attr["model"])
+    elif backend == "tflite":
+        return TFLiteEngine(
+            attr["model"], num_threads=attr.get("num_threads", DEFAULT_THREADS)
+        )
+    else:
+        raise ValueError("Unknown classifier backend %s" % (backend))
@@ -0,0 +1,101 @@
+import math
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Log spaced buckets from 0.1 ms to 10 s, 8 per decade
+MIN_SECONDS = 1e-4
+BUCKETS_PER_DECADE = 8
+DECADES = 5
+BUCKETS = BUCKETS_PER_DECADE * DECADES
+
+STAGES = ("preprocess", "invoke", "postprocess")
+
+
+class LatencyHistogram(object):
+    """Fixed log spaced histogram of durations, recording allocates nothing"""
+
+    def __init__(self):
+
+        self.counts = np.zeros(BUCKETS + 2, dtype=np.int64)  # Under and overflow
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+
+        if seconds < MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = int(math.log10(seconds / MIN_SECONDS) * BUCKETS_PER_DECADE) + 1
+            bucket = min(bucket, BUCKETS + 1)
+
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def _percentile(self, counts, fraction):
+        """Upper edge of the bucket holding this fraction of samples"""
+        position = np.searchsorted(np.cumsum(counts), fraction * self.count)
+        return MIN_SECONDS * 10 ** (position / BUCKETS_PER_DECADE)
+
+    def get_summary(self):
+        """Returns counts per bucket and summary statistics in milliseconds"""
+
+        counts = self.counts.copy()
+        summary = {"count": int(self.count)}
+        if not self.count:
+            return summary
+
+        edges = MIN_SECONDS * 10 ** (np.arange(BUCKETS + 1) / BUCKETS_PER_DECADE)
+        summary.update(
+            {
+                "mean_ms": 1000 * self.total / self.count,
+                "max_ms": 1000 * self.max,
+                "p50_ms": 1000 * min(self._percentile(counts, 0.5), self.max),
+                "p95_ms": 1000 * min(self._percentile(counts, 0.95), self.max),
+                "p99_ms": 1000 * min(self._percentile(counts, 0.99), self.max),
+                # Upper bucket edge in ms: samples, empty buckets left out
+                "buckets": {
+                    ("%.3g" % (1000 * edge) if bucket <= BUCKETS else "inf"): int(n)
+                    for bucket, (edge, n) in enumerate(
+                        zip(np.append(edges, np.inf), counts)
+                    )
+                    if n
+                },
+            }
+        )
+        return summary
+
+
+class LatencyStats(object):
+    """Per classifier stage histograms plus the queue wait before each frame"""
+
+    def __init__(self, names):
+
+        self.queue_wait = LatencyHistogram()
+        self.models = {
+            name: {stage: LatencyHistogram() for stage in STAGES} for name in names
+        }
+
+    def record(self, name, stage, seconds):
+        try:
+            histograms = self.models[name]
+        except KeyError:
+            histograms = {stage: LatencyHistogram() for stage in STAGES}
+            self.models[name] = histograms
+        histograms[stage].record(seconds)
+
+    def get_summary(self):
+        return {
+            "queue_wait": self.queue_wait.get_summary(),
+            "classifiers": {
+                name: {stage: h.get_summary() for stage, h in histograms.items()}
+                for name, histograms in self.models.items()
+            },
+        }
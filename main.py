@@ -7,6 +7,7 @@ from cloud import Cloud
 from classification import Classify
 from control import Control
 from data import Data
+from encoder import Encoder
 from config import Settings, Labels
 
 from datetime import datetime
@@ -24,9 +25,16 @@ logger = logging.getLogger(__name__)
 
 settings = Settings()
 labels = Labels()
+encoder = Encoder(
+    workers=settings.get_setting("encode_workers"),
+    use_process=settings.get_setting("encode_process"),
+)
 camera = Camera()
-thermal = ThermalCamera()
-cloud = Cloud()
+thermal = ThermalCamera(encoder=encoder)
+cloud = Cloud(
+    workers=settings.get_setting("upload_workers"),
+    public_bucket=settings.get_setting("upload_public_bucket"),
+)
 classify = Classify()
 data = Data()
 control = Control()
@@ -43,11 +51,14 @@ class OnionBot(object):
         logger.info("Launching worker threads...")
         camera.launch()
         thermal.launch()
-        cloud.launch_camera()
-        cloud.launch_thermal()
+        cloud.launch()
         classify.launch()
         control.launch()
 
+        # PID follows the thermal stream rather than the logging rate
+        if thermal.streaming:
+            control.set_temperature_source(thermal.get_latest_temperature)
+
         self.latest_meta = " "
         self.session_ID = None
         self.label = None
@@ -62,6 +73,9 @@ class OnionBot(object):
             measurement_ID = 0
             file_data = None
             meta = None
+            camera_frames = None
+            thermal_frame = None
+            thermal_fresh = False
 
             while True:
 
@@ -97,13 +111,19 @@ class OnionBot(object):
                 # While taking a picture, process previous data in meantime
                 if file_data:
 
-                    cloud.start_camera(file_data["camera_file"])
-                    cloud.start_thermal(file_data["thermal_file"])
-                    classify.start(file_data["camera_file"])
+                    # Previous thermal image was encoded during this capture
+                    thermal.join_image()
+
+                    cloud.start(file_data["camera_file"], "camera")
+                    if thermal_fresh:
+                        cloud.start(file_data["thermal_file"], "thermal")
+                    classify.start(
+                        file_data["camera_file"], camera_frames, thermal_frame
+                    )
 
                     # Wait for all meantime processes to finish
-                    cloud.join_camera()
-                    cloud.join_thermal()
+                    cloud.join("camera")
+                    cloud.join("thermal")
                     classify.join()
 
                     # Push meta information to file level for API access
@@ -113,7 +133,18 @@ class OnionBot(object):
                 # Wait for queued image captures to finish, refresh control data
                 thermal.join()
                 camera.join()
+                data.set_capture_time(
+                    queued_meta, queued_file_data, camera.get_capture_time()
+                )
+                queued_camera_frames = camera.get_frames()
+                # A repeated thermal frame is not classified, archived or uploaded
+                queued_thermal_fresh = thermal.fresh
+                queued_thermal_frame = thermal.frame if thermal.fresh else None
                 control.refresh(thermal.data["temperature"])
+                if thermal.fresh:
+                    data.archive_thermal(
+                        session_ID, timer, measurement_ID, thermal.raw_frame
+                    )
 
                 # Log to console
                 if meta is not None:
@@ -136,6 +167,9 @@ class OnionBot(object):
                 # Move queue forward one place
                 file_data = queued_file_data
                 meta = queued_meta
+                camera_frames = queued_camera_frames
+                thermal_frame = queued_thermal_frame
+                thermal_fresh = queued_thermal_fresh
 
                 # Add delay until ready for next loop
                 frame_interval = float(settings.get_setting("frame_interval"))
@@ -164,10 +198,8 @@ class OnionBot(object):
         """Stop logging"""
         self.session_ID = None
         labels = self.labels_csv_filepath
-        cloud.start_camera(
-            labels
-        )  # Use cloud uploader camera thread to upload label file
-        cloud.join_camera()
+        cloud.start(labels, "labels")
+        cloud.join("labels")
         return cloud.get_public_path(labels)
 
     def get_latest_meta(self):
@@ -190,6 +222,26 @@ class OnionBot(object):
         """Command to change current classifier for predictions"""
         classify.set_classifiers(string)
 
+    def get_classifier_latency(self):
+        """Returns per classifier stage and queue wait latency histograms"""
+        return classify.get_latency()
+
+    def get_thermal_acquisition_stats(self):
+        """Returns thermal acquisition error counters and frame latency"""
+        return dumps(thermal.get_acquisition_stats())
+
+    def get_classifier_gating_stats(self):
+        """Returns per input counts of model runs skipped by scene gating"""
+        return dumps(classify.get_gating_stats())
+
+    def get_classifier_rates(self):
+        """Returns target and achieved run rates of each classifier"""
+        return dumps(classify.get_classifier_rates())
+
+    def get_classifier_cache_stats(self):
+        """Returns result cache entries, hits and misses"""
+        return dumps(classify.get_cache_stats())
+
     def set_fixed_setpoint(self, value):
         """Command to change fixed setpoint"""
         control.update_fixed_setpoint(value)
@@ -253,4 +305,8 @@ class OnionBot(object):
         logger.info("Cloud module quit")
         classify.quit()
         logger.info("Classifier module quit")
+        encoder.quit()
+        logger.info("Encoder module quit")
+        data.quit()
+        logger.info("Data module quit")
         logger.info("Quit process complete")
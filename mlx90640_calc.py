@@ -0,0 +1,259 @@
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SCALEALPHA = 0.000001
+OPENAIR_TA_SHIFT = 8  # For a MLX90640 in the open air the shift is -8 degC
+EMISSIVITY = 0.95
+
+FRAME_WORDS = 834  # 832 RAM words, control register, subpage number
+
+
+def _signed(value):
+    """Interpret a 16 bit register word as two's complement"""
+    value = int(value)
+    return value - 65536 if value > 32767 else value
+
+
+class FrameCalculator(object):
+    """Vectorised replacement for the adafruit_mlx90640 temperature calculation
+
+    The EEPROM derived calibration is read from an initialised
+    `adafruit_mlx90640.MLX90640` once and stored as per-pixel arrays, so each
+    subpage becomes a handful of NumPy operations instead of a 768 step loop.
+    """
+
+    def __init__(self, mlx):
+
+        logger.debug("Precomputing thermal calibration arrays")
+
+        self.mlx = mlx
+
+        # Constant per-pixel geometry
+        p = np.arange(768)
+        il_pattern = p // 32 - (p // 64) * 2
+        chess_pattern = il_pattern ^ (p - (p // 2) * 2)
+        conversion_pattern = (
+            (p + 2) // 4 - (p + 3) // 4 + (p + 1) // 4 - p // 4
+        ) * (1 - 2 * il_pattern)
+
+        self.il_pattern = il_pattern
+        self.chess_pattern = chess_pattern
+
+        # Scalar calibration
+        self.kVdd = mlx.kVdd
+        self.vdd25 = mlx.vdd25
+        self.KvPTAT = mlx.KvPTAT
+        self.KtPTAT = mlx.KtPTAT
+        self.vPTAT25 = mlx.vPTAT25
+        self.alphaPTAT = mlx.alphaPTAT
+        self.gainEE = mlx.gainEE
+        self.tgc = mlx.tgc
+        self.KsTa = mlx.KsTa
+        self.resolutionEE = mlx.resolutionEE
+        self.calibrationModeEE = mlx.calibrationModeEE
+        self.cpKta = mlx.cpKta
+        self.cpKv = mlx.cpKv
+        self.cpOffset = list(mlx.cpOffset)
+        self.ilChessC = list(mlx.ilChessC)
+
+        self.ksTo = np.array(mlx.ksTo[:4], dtype=np.float64)
+        self.ct = np.array(mlx.ct[:4], dtype=np.float64)
+
+        alpha_corr_r = np.empty(4)
+        alpha_corr_r[0] = 1 / (1 + self.ksTo[0] * 40)
+        alpha_corr_r[1] = 1
+        alpha_corr_r[2] = 1 + self.ksTo[1] * self.ct[2]
+        alpha_corr_r[3] = alpha_corr_r[2] * (
+            1 + self.ksTo[2] * (self.ct[3] - self.ct[2])
+        )
+        self.alpha_corr_r = alpha_corr_r
+
+        # Per-pixel calibration
+        self.offset = np.array(mlx.offset, dtype=np.float64)
+        self.kta = np.array(mlx.kta, dtype=np.float64) / 2 ** mlx.ktaScale
+        self.kv = np.array(mlx.kv, dtype=np.float64) / 2 ** mlx.kvScale
+        self.alpha = SCALEALPHA * 2 ** mlx.alphaScale / np.array(
+            mlx.alpha, dtype=np.float64
+        )
+        self.il_correction = (
+            self.ilChessC[2] * (2 * il_pattern - 1)
+            - self.ilChessC[1] * conversion_pattern
+        )
+
+        bad = np.zeros(768, dtype=bool)
+        bad[list(mlx.brokenPixels) + list(mlx.outlierPixels)] = True
+        self.bad = bad
+
+        self._inbuf = bytearray(2 * 832)
+        self._frame_data = np.zeros(FRAME_WORDS, dtype=np.int32)
+
+    def _get_vdd(self, frame_data):
+        vdd = _signed(frame_data[810])
+
+        resolution_ram = (int(frame_data[832]) & 0x0C00) >> 10
+        resolution_correction = 2 ** self.resolutionEE / 2 ** resolution_ram
+        return (resolution_correction * vdd - self.vdd25) / self.kVdd + 3.3
+
+    def _get_ta(self, frame_data, vdd):
+        ptat = _signed(frame_data[800])
+        ptat_art = _signed(frame_data[768])
+        ptat_art = (ptat / (ptat * self.alphaPTAT + ptat_art)) * 2 ** 18
+
+        ta = ptat_art / (1 + self.KvPTAT * (vdd - 3.3)) - self.vPTAT25
+        return ta / self.KtPTAT + 25
+
+    def get_ta(self, frame_data):
+        """Ambient sensor temperature for a raw subpage"""
+        return self._get_ta(frame_data, self._get_vdd(frame_data))
+
+    def subpage_mask(self, frame_data):
+        """Boolean mask of the pixels measured by this raw subpage"""
+        mode = (int(frame_data[832]) & 0x1000) >> 5
+        pattern = self.il_pattern if mode == 0 else self.chess_pattern
+        return pattern == int(frame_data[833])
+
+    def calculate(self, frame_data, result, emissivity=EMISSIVITY, tr=None):
+        """Write the temperatures of one raw subpage into `result`
+
+        Mirrors `MLX90640._CalculateTo`. Like the original, a negative root
+        raises ValueError so the caller can retry the read.
+        """
+
+        sub_page = int(frame_data[833])
+
+        vdd = self._get_vdd(frame_data)
+        ta = self._get_ta(frame_data, vdd)
+        if tr is None:
+            tr = ta - OPENAIR_TA_SHIFT
+
+        ta4 = (ta + 273.15) ** 4
+        tr4 = (tr + 273.15) ** 4
+        ta_tr = tr4 - (tr4 - ta4) / emissivity
+
+        # Gain calculation
+        gain = self.gainEE / _signed(frame_data[778])
+
+        # Compensation pixels
+        mode = (int(frame_data[832]) & 0x1000) >> 5
+        ta_vdd = (1 + self.cpKta * (ta - 25)) * (1 + self.cpKv * (vdd - 3.3))
+
+        ir_data_cp = [
+            _signed(frame_data[776]) * gain - self.cpOffset[0] * ta_vdd,
+            _signed(frame_data[808]) * gain,
+        ]
+        if mode == self.calibrationModeEE:
+            ir_data_cp[1] -= self.cpOffset[1] * ta_vdd
+        else:
+            ir_data_cp[1] -= (self.cpOffset[1] + self.ilChessC[0]) * ta_vdd
+
+        # Object temperature calculation for this subpage only
+        mask = self.subpage_mask(frame_data) & ~self.bad
+
+        ir_data = np.asarray(frame_data[:768], dtype=np.float64)[mask]
+        ir_data[ir_data > 32767] -= 65536
+        ir_data *= gain
+
+        ir_data -= (
+            self.offset[mask]
+            * (1 + self.kta[mask] * (ta - 25))
+            * (1 + self.kv[mask] * (vdd - 3.3))
+        )
+        if mode != self.calibrationModeEE:
+            ir_data += self.il_correction[mask]
+
+        ir_data -= self.tgc * ir_data_cp[sub_page]
+        ir_data /= emissivity
+
+        alpha = self.alpha[mask] * (1 + self.KsTa * (ta - 25))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sx = alpha * alpha * alpha * (ir_data + alpha * ta_tr)
+            sx = np.sqrt(np.sqrt(sx)) * self.ksTo[1]
+
+            to = (
+                np.sqrt(
+                    np.sqrt(
+                        ir_data / (alpha * (1 - self.ksTo[1] * 273.15) + sx) + ta_tr
+                    )
+                )
+                - 273.15
+            )
+
+            torange = np.digitize(to, self.ct[1:4])
+
+            to = (
+                np.sqrt(
+                    np.sqrt(
+                        ir_data
+                        / (
+                            alpha
+                            * self.alpha_corr_r[torange]
+                            * (1 + self.ksTo[torange] * (to - self.ct[torange]))
+                        )
+                        + ta_tr
+                    )
+                )
+                - 273.15
+            )
+
+        if not np.isfinite(to).all():
+            raise ValueError("math domain error")
+
+        result[mask] = to
+        result[self.bad] = -273.15
+
+    def read_frame_data(self, frame_data):
+        """Read one raw subpage from the sensor into a 834 word array
+
+        Mirrors `MLX90640._GetFrameData` but decodes the 832 RAM words with a
+        single `np.frombuffer` instead of a per-word struct unpack.
+        """
+
+        mlx = self.mlx
+        data_ready = 0
+        cnt = 0
+        status_register = [0]
+        control_register = [0]
+
+        while data_ready == 0:
+            mlx._I2CReadWords(0x8000, status_register)
+            data_ready = status_register[0] & 0x0008
+
+        while (data_ready != 0) and (cnt < 5):
+            mlx._I2CWriteWord(0x8000, 0x0030)
+
+            with mlx.i2c_device as i2c:
+                i2c.write_then_readinto(bytes([0x04, 0x00]), self._inbuf)
+            frame_data[:832] = np.frombuffer(self._inbuf, dtype=">u2")
+
+            mlx._I2CReadWords(0x8000, status_register)
+            data_ready = status_register[0] & 0x0008
+            cnt += 1
+
+        if cnt > 4:
+            raise RuntimeError("Too many retries")
+
+        mlx._I2CReadWords(0x800D, control_register)
+        frame_data[832] = control_register[0]
+        frame_data[833] = status_register[0] & 0x0001
+        return frame_data[833]
+
+    def read_subpage(self, result):
+        """Read and calculate one subpage, return (subpage, mask of pixels written)"""
+
+        frame_data = self._frame_data
+        sub_page = int(self.read_frame_data(frame_data))
+        if sub_page < 0:
+            raise RuntimeError("Frame data error")
+        self.calculate(frame_data, result)
+        return sub_page, self.subpage_mask(frame_data)
+
+    def getFrame(self, framebuf):
+        """Drop-in replacement for `MLX90640.getFrame` writing into `framebuf`"""
+
+        for _ in range(2):
+            self.read_subpage(framebuf)
@@ -0,0 +1,133 @@
+import numpy as np
+
+from PIL import Image
+
+from thermal_render import MINTEMP, MAXTEMP, render
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Float models expect inputs scaled to [-1, 1]
+FLOAT_MEAN = 127.5
+FLOAT_STD = 127.5
+
+THUMBNAIL = 16
+
+MODALITIES = ("camera", "thermal", "fused")
+
+# Inputs each modality is built from
+SOURCES = {
+    "camera": ("camera",),
+    "thermal": ("thermal",),
+    "fused": ("camera", "thermal"),
+}
+
+
+class Preprocessor(object):
+    """Build model input tensors for one frame, each (modality, shape, dtype) once
+
+    Camera frames already at an input size are used as they are. Otherwise the
+    saved image is decoded once and resized once per shape, then shared by
+    every model with the same input. Thermal inputs are rendered from the
+    in-memory temperature frame with the same colour map as the saved images,
+    and fused inputs are an even blend of the camera and thermal images.
+    """
+
+    def __init__(self, file_path, frames=None, thermal=None):
+
+        self.file_path = file_path
+        self.frames = frames or {}
+        self.thermal = thermal
+        self.image = None
+        self.inputs = {}
+        self.tensors = {}
+
+    def _decode(self):
+        if self.image is None:
+            with Image.open(self.file_path) as image:
+                self.image = image.convert("RGB")
+        return self.image
+
+    def _rgb(self, shape):
+        try:
+            return self.frames[shape]
+        except KeyError:
+            pass
+
+        self._decode()
+        height, width, _ = shape
+        rgb = np.asarray(self.image.resize((width, height), Image.BILINEAR))
+        self.frames[shape] = rgb
+        return rgb
+
+    def _input(self, modality, shape):
+        """RGB array for a modality at (height, width, channels)"""
+
+        key = (modality, shape)
+        try:
+            return self.inputs[key]
+        except KeyError:
+            pass
+
+        if modality == "camera":
+            rgb = self._rgb(shape)
+        elif modality == "thermal":
+            if self.thermal is None:
+                raise ValueError("No thermal frame for a thermal input")
+            height, width, _ = shape
+            rgb = np.asarray(render(self.thermal, size=(width, height)))
+        elif modality == "fused":
+            camera = self._input("camera", shape).astype(np.uint16)
+            rgb = ((camera + self._input("thermal", shape)) // 2).astype(np.uint8)
+        else:
+            raise ValueError("Unknown input modality %s" % (modality))
+
+        self.inputs[key] = rgb
+        return rgb
+
+    def available(self, modality):
+        """Whether this frame has what a modality is built from"""
+        return "thermal" not in SOURCES[modality] or self.thermal is not None
+
+    def tensor(self, shape, dtype, modality="camera"):
+        """Flattened input tensor for a model with this (height, width, channels)"""
+
+        key = (modality, shape, np.dtype(dtype))
+        try:
+            return self.tensors[key]
+        except KeyError:
+            pass
+
+        rgb = self._input(modality, shape)
+        if key[2] == np.uint8:
+            tensor = np.ascontiguousarray(rgb).ravel()
+        else:
+            tensor = (rgb.astype(dtype).ravel() - FLOAT_MEAN) / FLOAT_STD
+            tensor = tensor.astype(dtype, copy=False)
+
+        self.tensors[key] = tensor
+        return tensor
+
+    def thumbnail(self, size=THUMBNAIL, source="camera"):
+        """Small greyscale copy of the frame for cheap change detection
+
+        Thermal thumbnails are the temperature frame mapped from the colour
+        map range to 0-255, so one change threshold suits both sources.
+        """
+
+        if source == "thermal":
+            thermal = np.asarray(self.thermal, dtype=np.float32).reshape(24, 32)
+            return (thermal - MINTEMP) * (255 / (MAXTEMP - MINTEMP))
+
+        if not self.frames:
+            image = self._decode().resize((size, size), Image.BILINEAR)
+            return np.asarray(image.convert("L"), dtype=np.float32)
+
+        # Block mean of the first camera frame, no decode or resize needed
+        rgb = next(iter(self.frames.values()))
+        height, width, _ = rgb.shape
+        blocks = rgb[: height - height % size, : width - width % size]
+        blocks = blocks.reshape(size, height // size, size, width // size, 3)
+        return blocks.mean(axis=(1, 3, 4), dtype=np.float32)
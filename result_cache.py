@@ -0,0 +1,104 @@
+import hashlib
+import json
+import sqlite3
+import time
+from threading import Lock
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MAX_ENTRIES = 200000
+EVICT_FRACTION = 0.1  # Share of entries removed at once when the cap is reached
+
+KEY = "WHERE model = ? AND frame = ? AND top_k = ?"
+
+
+def file_hash(file_path):
+    """Content hash of a model file"""
+
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_hash(tensor):
+    """Content hash of a model input tensor"""
+    return hashlib.blake2b(tensor.tobytes(), digest_size=16).hexdigest()
+
+
+class ResultCache(object):
+    """Classifier outputs stored in SQLite, keyed by model and frame content
+
+    Entries are keyed by (model hash, input tensor hash, top_k), so replaying
+    or re-evaluating a session reuses every result whose model and input are
+    unchanged. Once `max_entries` is exceeded the least recently used tenth
+    is removed. Safe to share between threads and processes.
+    """
+
+    def __init__(self, file_path, max_entries=MAX_ENTRIES):
+
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(file_path, timeout=30, check_same_thread=False)
+        # Write ahead logging keeps a commit per result cheap on an SD card
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "model TEXT, frame TEXT, top_k INTEGER, results TEXT, used REAL, "
+                "PRIMARY KEY (model, frame, top_k))"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS used ON results (used)")
+            self.count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, model, frame, top_k):
+        """Returns the cached [(label index, probability)] results, None if absent"""
+
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT results FROM results " + KEY, (model, frame, top_k)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.db.execute(
+                "UPDATE results SET used = ? " + KEY, (time.time(), model, frame, top_k)
+            )
+            self.hits += 1
+        return [tuple(result) for result in json.loads(row[0])]
+
+    def put(self, model, frame, top_k, results):
+
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (model, frame, top_k, json.dumps(results), time.time()),
+            )
+            self.count += 1
+
+            if self.count > self.max_entries:
+                self.db.execute(
+                    "DELETE FROM results WHERE rowid IN "
+                    "(SELECT rowid FROM results ORDER BY used LIMIT ?)",
+                    (int(self.max_entries * EVICT_FRACTION) + 1,),
+                )
+                self.count = self.db.execute(
+                    "SELECT COUNT(*) FROM results"
+                ).fetchone()[0]
+                logger.debug("Result cache trimmed to %d entries" % (self.count))
+
+    def get_stats(self):
+        return {"entries": self.count, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,62 @@
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+THRESHOLD = 3.0  # Mean absolute grey level change (0-255) that counts as new
+MAX_STALE = 10.0  # Seconds a result may be reused before the model runs again
+
+
+class SceneGate(object):
+    """Decide whether a frame differs enough from the last classified one
+
+    Frames are compared as small greyscale thumbnails against the thumbnail
+    of the last frame that was actually classified, so a slow drift still
+    adds up to a change instead of being compared away frame by frame.
+    """
+
+    def __init__(self, threshold=THRESHOLD, max_stale=MAX_STALE):
+
+        self.threshold = threshold
+        self.max_stale = max_stale
+        self.reference = None
+
+        self.frames = 0
+        self.changes = 0
+        self.inferences = 0
+        self.skipped = 0
+
+    def changed(self, thumbnail):
+        """Whether inference is needed, updates the reference if so"""
+
+        self.frames += 1
+        if (
+            self.reference is not None
+            and np.mean(np.abs(thumbnail - self.reference)) <= self.threshold
+        ):
+            return False
+
+        self.reference = thumbnail
+        self.changes += 1
+        return True
+
+    def fresh(self, stamp, now):
+        """Whether a result classified at `stamp` may still be reused"""
+        return now - stamp < self.max_stale
+
+    def record(self, inferences, skipped):
+        self.inferences += inferences
+        self.skipped += skipped
+
+    def get_stats(self):
+        """Returns counters of frames seen and model runs skipped"""
+        total = self.inferences + self.skipped
+        return {
+            "frames": self.frames,
+            "scene_changes": self.changes,
+            "inferences": self.inferences,
+            "skipped": self.skipped,
+            "skipped_fraction": self.skipped / total if total else 0.0,
+        }
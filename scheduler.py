@@ -0,0 +1,112 @@
+from collections import deque
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+BUDGET = 0.8  # Seconds of estimated inference admitted per frame
+SMOOTHING = 0.2  # Weight of the newest run in each model's cost estimate
+RATE_WINDOW = 20  # Runs used to measure the achieved rate
+
+
+class Scheduler(object):
+    """Choose which classifiers run on each frame
+
+    Each classifier has a target `rate` in runs per second (0 runs on every
+    frame) and a `priority` (0 is most important). Models that are due are
+    admitted in priority order, most overdue first, until their estimated
+    run times fill the per-frame budget. The most important due model always
+    runs, so low priority work is the first to be dropped under load.
+    """
+
+    def __init__(self, budget=BUDGET):
+
+        self.budget = budget
+        self.models = {}
+
+    def configure(self, name, rate=0, priority=0):
+        if name not in self.models:
+            self.models[name] = {
+                "rate": rate,
+                "priority": priority,
+                "cost": 0.0,
+                "last_run": None,
+                "runs": deque(maxlen=RATE_WINDOW),
+                "deferred": 0,
+            }
+        else:
+            self.models[name]["rate"] = rate
+            self.models[name]["priority"] = priority
+
+    def _overdue(self, model, now):
+        """Seconds past due, None if not due yet"""
+        if model["last_run"] is None:
+            return float("inf")
+        interval = 1 / model["rate"] if model["rate"] else 0
+        overdue = now - model["last_run"] - interval
+        return overdue if overdue >= 0 else None
+
+    def select(self, names, now):
+        """Split `names` into the models to run now and the ones deferred"""
+
+        due = []
+        waiting = []
+        for name in names:
+            model = self.models[name]
+            overdue = self._overdue(model, now)
+            if overdue is None:
+                waiting.append(name)
+            else:
+                due.append((model["priority"], -overdue, name))
+
+        run = []
+        deferred = []
+        spent = 0.0
+        for _, _, name in sorted(due):
+            cost = self.models[name]["cost"]
+            if not run or spent + cost <= self.budget:
+                run.append(name)
+                spent += cost
+            else:
+                self.models[name]["deferred"] += 1
+                deferred.append(name)
+
+        if deferred:
+            logger.debug("Over budget, deferred %s" % (deferred))
+
+        return run, waiting + deferred
+
+    def record(self, name, now, duration=None):
+        """Log a completed run and update the model's cost estimate
+
+        Runs answered without inference (`duration` None) leave the cost as is.
+        """
+
+        model = self.models[name]
+        if duration is not None:
+            if model["last_run"] is None or not model["cost"]:
+                model["cost"] = duration
+            else:
+                model["cost"] += SMOOTHING * (duration - model["cost"])
+        model["last_run"] = now
+        model["runs"].append(now)
+
+    def get_rates(self):
+        """Returns target and achieved runs per second for every classifier"""
+
+        rates = {}
+        for name, model in self.models.items():
+            runs = model["runs"]
+            if len(runs) > 1 and runs[-1] > runs[0]:
+                achieved = (len(runs) - 1) / (runs[-1] - runs[0])
+            else:
+                achieved = None
+            rates[name] = {
+                "target": model["rate"],
+                "achieved": achieved,
+                "priority": model["priority"],
+                "cost": model["cost"],
+                "deferred": model["deferred"],
+            }
+        return rates
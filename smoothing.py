@@ -0,0 +1,78 @@
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+WINDOW = 5
+
+
+class ConfidenceAverage(object):
+    """Moving average of one classifier's label confidences
+
+    The last `window` confidences of every label are kept in a labels x window
+    array written as a ring, with a running sum per label, so each frame is an
+    O(labels) update and the thresholds are compared in one vectorised step.
+    """
+
+    def __init__(self, labels, thresholds, window=WINDOW):
+
+        indices = sorted(labels)
+        self.names = [labels[index] for index in indices]
+        self.rows = {index: row for row, index in enumerate(indices)}
+        self.thresholds = np.array([thresholds[name] for name in self.names])
+        self.window = window
+
+        self.queue = np.zeros((len(self.names), window))
+        self.sums = np.zeros(len(self.names))
+        self.confidence = np.zeros(len(self.names))
+        self.position = 0
+
+    def update(self, results):
+        """Add one frame of (label index, probability) results, return the storage
+
+        Labels missing from `results` count as zero confidence, which keeps the
+        average decaying while they are out of the top_k.
+        """
+
+        confidence = self.confidence
+        confidence[:] = 0
+        for index, probability in results:
+            confidence[self.rows[index]] = probability
+        np.round(confidence, 2, out=confidence)
+
+        column = self.queue[:, self.position]
+        self.sums += confidence - column
+        column[:] = confidence
+
+        self.position = (self.position + 1) % self.window
+        if self.position == 0:
+            # Resum once per window so rounding errors never accumulate
+            self.queue.sum(axis=1, out=self.sums)
+
+        average = np.round(self.sums / self.window, 2)
+        boolean = average >= self.thresholds
+
+        return self._storage(average, boolean)
+
+    def _storage(self, average, boolean):
+        """Database entry in the original nested dictionary format"""
+
+        # Oldest first, as the queue was stored before
+        queue = np.roll(self.queue, -self.position, axis=1).tolist()
+        confidence = self.confidence.tolist()
+        average = average.tolist()
+        thresholds = self.thresholds.tolist()
+        boolean = boolean.tolist()
+
+        storage = {}
+        for row, label in enumerate(self.names):
+            storage[label] = {
+                "queue": queue[row],
+                "confidence": confidence[row],
+                "average": average[row],
+                "threshold": thresholds[row],
+                "boolean": boolean[row],
+            }
+        return storage
@@ -0,0 +1,131 @@
+from os import path
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"ONIONTHM"
+VERSION = 1
+HEADER_BYTES = 64
+CHUNK = 1024  # Records added each time the file grows
+
+HEADER = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("rows", "<u4"),
+        ("columns", "<u4"),
+        ("record_bytes", "<u4"),
+        ("count", "<u8"),
+        ("capacity", "<u8"),
+    ]
+)
+
+RECORD = np.dtype(
+    [
+        ("time_stamp", "<f8"),
+        ("measurement_ID", "<i8"),
+        ("frame", "<f2", (24, 32)),
+    ]
+)
+
+
+def _read_header(file_path):
+    header = np.fromfile(file_path, dtype=HEADER, count=1)[0]
+    if header["magic"] != MAGIC or header["version"] != VERSION:
+        raise ValueError("%s is not a thermal archive" % (file_path))
+    return header
+
+
+def open_archive(file_path):
+    """Map an archive read-only and return its records
+
+    Fields are `time_stamp` (Unix seconds), `measurement_ID` and `frame`
+    (24 x 32 float16 degrees), so `records["frame"][1000:2000]` slices frames
+    straight from disk without decoding any images.
+    """
+
+    header = _read_header(file_path)
+    return np.memmap(
+        file_path,
+        dtype=RECORD,
+        mode="r",
+        offset=HEADER_BYTES,
+        shape=(int(header["count"]),),
+    )
+
+
+class ThermalArchive(object):
+    """Append raw thermal frames to a memory-mapped per-session file
+
+    The file is a 64 byte header followed by fixed size records, grown in
+    chunks so appending is a copy into mapped memory rather than a write call.
+    """
+
+    def __init__(self, file_path, chunk=CHUNK):
+
+        self.file_path = file_path
+        self.chunk = chunk
+
+        if path.isfile(file_path):
+            header = _read_header(file_path)
+            self.count = int(header["count"])
+            self._map(int(header["capacity"]))
+            logger.debug("Appending to thermal archive with %d frames" % (self.count))
+        else:
+            self.count = 0
+            self._map(chunk)
+
+    def _map(self, capacity):
+        """(Re)map the file with room for `capacity` records"""
+
+        size = HEADER_BYTES + capacity * RECORD.itemsize
+        with open(self.file_path, "ab") as file:
+            if file.tell() < size:
+                file.truncate(size)
+
+        self.header = np.memmap(
+            self.file_path, dtype=HEADER, mode="r+", offset=0, shape=(1,)
+        )
+        self.records = np.memmap(
+            self.file_path,
+            dtype=RECORD,
+            mode="r+",
+            offset=HEADER_BYTES,
+            shape=(capacity,),
+        )
+        self.capacity = capacity
+
+        header = self.header[0]
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["rows"], header["columns"] = RECORD["frame"].shape
+        header["record_bytes"] = RECORD.itemsize
+        header["count"] = self.count
+        header["capacity"] = capacity
+        self.header[0] = header
+
+    def append(self, time_stamp, measurement_ID, frame):
+
+        if self.count == self.capacity:
+            self.flush()
+            self._map(self.capacity + self.chunk)
+
+        records = self.records
+        records["time_stamp"][self.count] = time_stamp
+        records["measurement_ID"][self.count] = measurement_ID
+        records["frame"][self.count] = np.asarray(frame).reshape(24, 32)
+
+        # Count last, so a reader never sees a half written record
+        self.count += 1
+        self.header["count"] = self.count
+
+    def flush(self):
+        self.records.flush()
+        self.header.flush()
+
+    def close(self):
+        self.flush()
+        del self.records, self.header
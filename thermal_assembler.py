@@ -0,0 +1,197 @@
+from multiprocessing import Array
+import time
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MAX_REPAIRS = 8  # Bad pixels per subpage that can be patched rather than re-read
+MAX_READS = 6  # Subpage reads per frame before falling back to the previous half
+ERROR_BACKOFF = 0.01  # Seconds to wait after a failed read before trying again
+
+# Layout of the shared statistics array
+STATS = (
+    "frames",
+    "subpages",
+    "value_error",
+    "runtime_error",
+    "os_error",
+    "zero_pixels",
+    "max_temp_pixels",
+    "min_temp_pixels",
+    "repaired_pixels",
+    "rejected_subpages",
+    "stale_subpages",
+    "last_latency",
+    "max_latency",
+)
+
+
+def new_stats():
+    """Allocate statistics in shared memory so a worker process can update them"""
+    return Array("d", len(STATS), lock=False)
+
+
+def read_stats(stats):
+    """Return the shared statistics as a dictionary"""
+    return {name: stats[i] for i, name in enumerate(STATS)}
+
+
+class FrameAssembler(object):
+    """Build MLX90640 frames from independently validated subpages
+
+    Each half of the chessboard is checked on its own. A handful of zero or
+    out of range pixels are patched from their validated neighbours (or the
+    previous frame), and only a half with too many bad pixels is read again.
+    If a half cannot be read within `max_reads` the previous value is kept,
+    which bounds the time spent on any one frame, even before the sensor has
+    delivered a first full frame.
+    """
+
+    def __init__(
+        self,
+        read_subpage,
+        min_temp,
+        max_temp,
+        stats=None,
+        max_repairs=MAX_REPAIRS,
+        max_reads=MAX_READS,
+    ):
+
+        self.read_subpage = read_subpage
+        self.min_temp = min_temp
+        self.max_temp = max_temp
+        self.max_repairs = max_repairs
+        self.max_reads = max_reads
+
+        if stats is None:
+            stats = new_stats()
+        self.stats = np.frombuffer(stats, dtype=np.float64)
+
+        self.frame = np.zeros((24, 32))
+        self.valid = np.zeros((24, 32), dtype=bool)
+        self.values = np.zeros(768)
+
+        # Preallocated scratch for the neighbour average
+        self._padded = np.zeros((26, 34))
+        self._padded_valid = np.zeros((26, 34))
+
+    def _count(self, name, amount=1):
+        self.stats[STATS.index(name)] += amount
+
+    def _repair(self, frame, valid, bad):
+        """Replace bad pixels in `frame` with the mean of valid 4-neighbours"""
+
+        padded = self._padded
+        padded_valid = self._padded_valid
+
+        valid = valid & ~bad
+        padded_valid[1:-1, 1:-1] = valid
+        padded[1:-1, 1:-1] = np.where(valid, frame, 0)
+
+        total = (
+            padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+        )
+        count = (
+            padded_valid[:-2, 1:-1]
+            + padded_valid[2:, 1:-1]
+            + padded_valid[1:-1, :-2]
+            + padded_valid[1:-1, 2:]
+        )
+
+        # Without any valid neighbour fall back to the previous frame
+        patch = bad & (count > 0)
+        frame[patch] = total[patch] / count[patch]
+        keep = bad & (count == 0) & self.valid
+        return int(np.count_nonzero(bad & ~(patch | keep)))
+
+    def _accept(self, mask, values):
+        """Validate one subpage, return True if it was merged into the frame"""
+
+        mask = mask.reshape(24, 32)
+        values = values.reshape(24, 32)
+
+        zero = mask & (values == 0)
+        high = mask & (values > self.max_temp)
+        low = mask & (values < self.min_temp) & ~zero
+        bad = zero | high | low
+        good = mask & ~bad
+
+        bad_count = int(np.count_nonzero(bad))
+        if not bad_count:
+            self.frame[good] = values[good]
+            self.valid |= mask
+            return True
+
+        self._count("zero_pixels", np.count_nonzero(zero))
+        self._count("max_temp_pixels", np.count_nonzero(high))
+        self._count("min_temp_pixels", np.count_nonzero(low))
+
+        if bad_count > self.max_repairs:
+            logger.debug("Rejected subpage with %d bad pixels" % (bad_count))
+            self._count("rejected_subpages")
+            return False
+
+        # Repair a copy, the frame only changes if the whole subpage is accepted
+        frame = np.where(good, values, self.frame)
+        if self._repair(frame, self.valid | good, bad):
+            self._count("rejected_subpages")
+            return False
+
+        self._count("repaired_pixels", bad_count)
+        self.frame = frame
+        self.valid |= mask
+        return True
+
+    def get_frame(self, out):
+        """Fill `out` with a frame, re-reading only the failing half
+
+        Returns False unless a subpage was merged on this call and a full frame
+        has been assembled, so a previous frame is never passed off as new.
+        """
+
+        stamp = time.monotonic()
+        missing = {0, 1}
+        reads = 0
+        merged = False
+
+        while missing:
+
+            # Bound latency, a missing sensor must not hold the caller
+            if reads >= self.max_reads:
+                self._count("stale_subpages", len(missing))
+                logger.debug("Keeping previous data for subpages %s" % (missing))
+                break
+
+            reads += 1
+            try:
+                sub_page, mask = self.read_subpage(self.values)
+            except ValueError:  # Negative root in the temperature maths
+                self._count("value_error")
+                time.sleep(ERROR_BACKOFF)
+                continue
+            except RuntimeError:  # Sensor not ready, too many retries
+                self._count("runtime_error")
+                time.sleep(ERROR_BACKOFF)
+                continue
+            except OSError:  # I2C bus error, give the bus a moment
+                self._count("os_error")
+                time.sleep(ERROR_BACKOFF)
+                continue
+
+            self._count("subpages")
+            if self._accept(mask, self.values):
+                missing.discard(sub_page)
+                merged = True
+
+        out[:] = self.frame.ravel()
+
+        latency = time.monotonic() - stamp
+        self._count("frames")
+        self.stats[STATS.index("last_latency")] = latency
+        index = STATS.index("max_latency")
+        self.stats[index] = max(self.stats[index], latency)
+
+        return merged and bool(self.valid.all())
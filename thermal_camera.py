@@ -1,19 +1,28 @@
-from threading import Thread, Event
-from queue import Queue, Empty
+import multiprocessing as mp
+from multiprocessing import JoinableQueue, Event
+from threading import Thread, Lock
+from queue import Empty
 
-import math
-from statistics import mean
 import time
 import board
 import busio
-from PIL import Image
 from collections import deque
+import numpy as np
 
 import adafruit_mlx90640
+from mlx90640_calc import FRAME_WORDS, OPENAIR_TA_SHIFT, FrameCalculator
+from thermal_assembler import FrameAssembler, new_stats, read_stats
+from encoder import encode_thermal
+from frame_buffer import FrameRing
+from thermal_roi import CENTER_SQUARE, PanROI
+from thermal_filter import make_filter
+from config import Settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+config = Settings()
+
 
 CHESSBOARD_MAX_THRESHOLD = 300
 CHESSBOARD_MIN_THRESHOLD = 5
@@ -21,203 +30,167 @@ CHESSBOARD_MIN_THRESHOLD = 5
 TEMPERATURE_MULTIPLIER = 1.35
 TEMPERATURE_OFFSET = -6
 
+FRAME_SLOTS = 32  # About two seconds of history when streaming
 
-INTERPOLATE = 10
+# Each ring slot holds the raw frame and its temporally filtered copy
+RAW = 0
+FILTERED = 1
 
-MINTEMP = 20.0  # -40 #low range of the sensor (this will be black on the screen)
-MAXTEMP = 200.0  # previous 50 #max 300 #high range of the sensor (this will be white on the screen)
-SCALE = 25
 
+class ThermalCamera(object):
+    """Wrapper for the Adafruit MLX90640 thermal camera module (threaded or multiprocessing)"""
 
-# the list of colors we can choose from
-heatmap = (
-    (0.0, (0, 0, 0)),
-    (0.20, (0, 0, 0.5)),
-    (0.40, (0, 0.5, 0)),
-    (0.60, (0.5, 0, 0)),
-    (0.80, (0.75, 0.75, 0)),
-    (0.90, (1.0, 0.75, 0)),
-    (1.00, (1.0, 1.0, 1.0)),
-)
+    def __init__(self, i2c=None, visualise_on=False, encoder=None):
 
-# how many color values we can have
-COLORDEPTH = 1000
+        self.i2c = i2c
 
-colormap = [0] * COLORDEPTH
+        # Images are rendered on this pool so acquisition never waits on PIL
+        self.encoder = encoder
+        self.image_format = config.get_setting("thermal_format")
+        self.image_quality = config.get_setting("thermal_quality")
+        self.image_size = config.get_setting("thermal_size")
 
+        self.quit_event = Event()
+        self.file_queue = JoinableQueue(1)
 
-class ThermalCamera(object):
-    """Save image to file"""
+        # Acquire in a separate process to keep I2C and frame maths off the GIL
+        self.use_process = config.get_setting("thermal_process")
 
-    def __init__(self, i2c=None, visualise_on=False):
+        # Sample continuously rather than once per start() request
+        self.streaming = config.get_setting("thermal_streaming")
+        self.file_path = None
 
-        self.quit_event = Event()
+        # Validated frames are published here by the worker, read without pickling
+        self.ring = FrameRing((2, 768), dtype=np.float32, slots=FRAME_SLOTS)
+        self.sequence = 0
+        self.frame = None
+        self.raw_frame = None
+        self.fresh = False  # Whether the last join() found a new frame
+
+        self.latest_sequence = 0
+        self.latest_temperature = None
+
+        # Acquisition error counters and latency, shared with the worker
+        self.stats = new_stats()
+
+        # Find the pan in each frame instead of assuming it is centred
+        self.roi = PanROI() if config.get_setting("thermal_roi") else None
+        self.roi_lock = Lock()  # Measured from the main and control threads
+
+        self.temperature = 0
+        self.thermal_history = deque([0] * 120)
+        self.pan_temperature = None
+
+        self.data = {
+            "temperature": None,
+            "thermal_history": None,
+            "pan_temperature": None,
+        }
+
+    def _open_sensor(self):
+        """Open the sensor inside the worker so I2C belongs to the acquiring process"""
 
         logger.info("Initialising thermal camera...")
 
+        i2c = self.i2c
         if i2c is None:
             i2c = busio.I2C(board.SCL, board.SDA)
 
         mlx = adafruit_mlx90640.MLX90640(i2c)
         mlx.refresh_rate = adafruit_mlx90640.RefreshRate.REFRESH_32_HZ
 
-        self.mlx = mlx
+        calculator = FrameCalculator(mlx)
 
-        self.file_queue = Queue(1)
+        # Pick the frame calculation backend, both read one subpage at a time
+        backend = config.get_setting("thermal_backend")
+        if backend == "numpy":
+            logger.info("Using NumPy thermal frame calculation")
+            return calculator.read_subpage
+        elif backend == "adafruit":
+            frame_data = [0] * FRAME_WORDS
 
-        self.temperature = 0
-        self.thermal_history = deque([0] * 120)
+            def read_subpage(result):
+                sub_page = mlx._GetFrameData(frame_data)
+                if sub_page < 0:
+                    raise RuntimeError("Frame data error")
+                tr = mlx._GetTa(frame_data) - OPENAIR_TA_SHIFT
+                mlx._CalculateTo(frame_data, 0.95, tr, result)
+                return sub_page, calculator.subpage_mask(frame_data)
 
-        self.data = {
-            "temperature": None,
-            "thermal_history": None,
-        }
+            return read_subpage
+        else:
+            raise ValueError("Unknown thermal_backend %s" % (backend))
 
-    def _constrain(self, val, min_val, max_val):
-        return min(max_val, max(min_val, val))
+    def _calibrate(self, temperature):
+        return (temperature * TEMPERATURE_MULTIPLIER) + TEMPERATURE_OFFSET
 
-    def _map_value(self, x, in_min, in_max, out_min, out_max):
-        return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    def _measure(self, frame):
+        """Calibrated pan statistics, or the centre square when ROI is disabled"""
 
-    def _gaussian(self, x, a, b, c, d=0):
-        return a * math.exp(-((x - b) ** 2) / (2 * c ** 2)) + d
+        if self.roi is None:
+            temperature = float(np.mean(frame[CENTER_SQUARE]))
+            return {"mean": self._calibrate(temperature)}
 
-    def _gradient(self, x, width, cmap, spread=1):
-        width = float(width)
-        r = sum(
-            [
-                self._gaussian(x, p[1][0], p[0] * width, width / (spread * len(cmap)))
-                for p in cmap
-            ]
-        )
-        g = sum(
-            [
-                self._gaussian(x, p[1][1], p[0] * width, width / (spread * len(cmap)))
-                for p in cmap
-            ]
-        )
-        b = sum(
-            [
-                self._gaussian(x, p[1][2], p[0] * width, width / (spread * len(cmap)))
-                for p in cmap
-            ]
-        )
-        r = int(self._constrain(r * 255, 0, 255))
-        g = int(self._constrain(g * 255, 0, 255))
-        b = int(self._constrain(b * 255, 0, 255))
-        return r, g, b
+        with self.roi_lock:
+            statistics = self.roi.measure(frame)
+        for key in ("mean", "max", "percentile"):
+            statistics[key] = self._calibrate(statistics[key])
+        return statistics
+
+    def _value(self, frame):
+
+        logger.debug("Proccessing numerical data")
+
+        self.pan_temperature = self._measure(frame)
+        temperature = "{:.1f}".format(self.pan_temperature["mean"])
+
+        self.temperature = temperature
+
+        thermal_history = self.thermal_history
+        thermal_history.append(temperature)
+        thermal_history.popleft()
+        self.thermal_history = thermal_history
+
+        return thermal_history
+
+    def _image(self, frame, file_path):
+
+        logger.debug("Proccessing image data")
+
+        args = (frame, file_path, self.image_format, self.image_quality, self.image_size)
+        if self.encoder is None:
+            encode_thermal(*args)
+        else:
+            self.encoder.submit(encode_thermal, *args)
 
     def _worker(self):
-        def _value(frame):
-
-            logger.debug("Proccessing numerical data")
-
-            f = frame
-            center_square = [
-                f[72],
-                f[73],
-                f[74],
-                f[75],
-                f[88],
-                f[89],
-                f[90],
-                f[91],
-                f[104],
-                f[105],
-                f[106],
-                f[107],
-                f[120],
-                f[121],
-                f[122],
-                f[123],
-            ]
-
-            temperature = mean(center_square)
-            temperature = (temperature * TEMPERATURE_MULTIPLIER) + TEMPERATURE_OFFSET
-            temperature = "{:.1f}".format(temperature)
-
-            self.temperature = temperature
-
-            thermal_history = self.thermal_history
-            thermal_history.append(temperature)
-            thermal_history.popleft()
-            self.thermal_history = thermal_history
-
-            return thermal_history
-
-        def _image(frame, file_path):
-
-            logger.debug("Proccessing image data")
-
-            for i in range(COLORDEPTH):
-                colormap[i] = self._gradient(i, COLORDEPTH, heatmap)
-
-            pixels = [0] * 768
-            for i, pixel in enumerate(frame):
-                coloridx = self._map_value(pixel, MINTEMP, MAXTEMP, 0, COLORDEPTH - 1)
-                coloridx = int(self._constrain(coloridx, 0, COLORDEPTH - 1))
-                pixels[i] = colormap[coloridx]
-
-            img = Image.new("RGB", (32, 24))
-            img.putdata(pixels)
-            img = img.resize((24 * INTERPOLATE, 24 * INTERPOLATE), Image.BICUBIC)
-
-            img = img.transpose(method=Image.ROTATE_90)
-            img = img.transpose(method=Image.FLIP_LEFT_RIGHT)
-            img.save(file_path)
+
+        assembler = FrameAssembler(
+            self._open_sensor(),
+            min_temp=CHESSBOARD_MIN_THRESHOLD,
+            max_temp=CHESSBOARD_MAX_THRESHOLD,
+            stats=self.stats,
+        )
+
+        smoother = make_filter(config)
+        frames = np.zeros((2, 768))
+
+        if self.streaming:
+            self._stream(assembler, smoother, frames)
+            return
 
         while True:
 
             try:  # Timeout raises queue.Empty
-                file_path = self.file_queue.get(block=True, timeout=0.1)
+                self.file_queue.get(block=True, timeout=0.1)
 
                 logger.debug("Capturing frame")
-                frame = [0] * 768
                 stamp = time.monotonic()
-                while True:
-                    try:
-                        self.mlx.getFrame(frame)
-                    except ValueError:  # Handle ValueError in module
-                        logger.debug("Frame capture error, retrying [ValueError]")
-                        time.sleep(0.1)
-                        continue
-                    except RuntimeError:  # Handle RuntimeError in module
-                        logger.debug("Frame capture error, retrying [RuntimeError]")
-                        time.sleep(0.1)
-                        continue
-                    except OSError:  # Handle RuntimeError in module
-                        logger.info("Frame capture error, retrying [OSError]")
-                        time.sleep(0.1)
-                        continue
-
-                    if 0 in frame:  # Handle chessboard error zeros
-                        logger.debug("Frame capture error, retrying [Zero Error]")
-                        time.sleep(0.1)
-                        continue
-
-                    if max(frame) > CHESSBOARD_MAX_THRESHOLD:
-                        logger.debug(
-                            "Frame capture error, retrying [Max Temp Error: %0.2f ]"
-                            % (max(frame))
-                        )
-                        time.sleep(0.1)
-                        continue
-                    elif min(frame) < CHESSBOARD_MIN_THRESHOLD:
-                        logger.debug(
-                            "Frame capture error, retrying [MIN Temp Error: %0.2f ]"
-                            % (min(frame))
-                        )
-                        time.sleep(0.1)
-                        continue
-
-                    break
+                self._acquire(assembler, smoother, frames)
 
                 logger.debug("Read 2 frames in %0.3f s" % (time.monotonic() - stamp))
 
-                # Call numerical and graphical functions
-                _value(frame)
-                _image(frame, file_path)
-
+                # Image is encoded by the caller, this worker only acquires
                 self.file_queue.task_done()
 
             except Empty:
@@ -225,6 +198,39 @@ class ThermalCamera(object):
                     logger.debug("Quitting thermal camera thread...")
                     break
 
+    def _acquire(self, assembler, smoother, frames):
+        """Read a frame, filter it and publish both for the main process"""
+
+        if not assembler.get_frame(frames[RAW]):
+            logger.debug("No new thermal frame, nothing published")
+            return
+        smoother.update(frames[RAW], frames[FILTERED])
+        self.ring.publish(frames)
+
+    def _stream(self, assembler, smoother, frames):
+        """Sample continuously at the sensor rate into the ring buffer"""
+
+        while not self.quit_event.is_set():
+            self._acquire(assembler, smoother, frames)
+
+        logger.debug("Quitting thermal camera thread...")
+
+    def _refresh(self):
+        """Pull the newest published frame into temperature and history
+
+        Returns False if nothing has been published since the last refresh.
+        """
+
+        latest = self.ring.latest()
+        if latest is None or latest[0] == self.sequence:
+            return False
+
+        self.sequence, stamp, frames = latest
+        self.raw_frame = frames[RAW]
+        self.frame = frames[FILTERED]
+        self._value(self.frame)
+        return True
+
     def get_temperature(self):
         temperature = self.temperature
         logger.debug("self.temperature is %s " % (temperature))
@@ -237,24 +243,66 @@ class ThermalCamera(object):
 
         return thermal_history
 
+    def get_latest_temperature(self):
+        """Calibrated temperature of the newest sensor frame, None before the first"""
+
+        sequence = self.ring.sequence
+        if sequence != self.latest_sequence:
+            result = self.ring.read(sequence)
+            if result is not None:
+                self.latest_temperature = self._measure(result[1][FILTERED])["mean"]
+                self.latest_sequence = sequence
+
+        return self.latest_temperature
+
+    def get_acquisition_stats(self):
+        """Returns error counters and frame latency of the acquisition worker"""
+        return read_stats(self.stats)
+
     def start(self, file_path):
         logger.debug("Calling start")
-        self.file_queue.put(file_path, block=True)
+        self.file_path = file_path
+        if not self.streaming:
+            self.file_queue.put(file_path, block=True)
 
     def join(self):
         logger.debug("Calling join")
-        self.file_queue.join()
+        if self.streaming:
+            # Snapshot the newest streamed frame, only waits before the first one
+            while self.ring.sequence == 0 and not self.quit_event.is_set():
+                time.sleep(0.01)
+        else:
+            self.file_queue.join()
+        self.fresh = self._refresh()
+
+        # Queue the image, it is written alongside the next capture
+        if self.fresh:
+            self._image(self.frame, self.file_path)
 
         self.data = {
             "temperature": self.get_temperature(),
             "thermal_history": self.get_thermal_history(),
+            "pan_temperature": self.pan_temperature,
         }
 
     def launch(self):
         logger.debug("Initialising worker")
-        self.thread = Thread(target=self._worker, daemon=True)
-        self.thread.start()
+        if self.use_process:
+            self.p = mp.Process(target=self._worker, daemon=True)
+            self.p.start()
+        else:
+            self.thread = Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    def join_image(self):
+        """Wait for queued images to be written, call before uploading them"""
+        if self.encoder is not None:
+            self.encoder.join()
 
     def quit(self):
         self.quit_event.set()
-        self.thread.join()
+        if self.use_process:
+            self.p.join()
+        else:
+            self.thread.join()
+        self.ring.close()
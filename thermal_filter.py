@@ -0,0 +1,148 @@
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+PIXELS = 768
+PERSIST = 3  # Frames a step must last to be followed rather than clamped
+
+
+def _limit(deviation, clamp, count, persist):
+    """Clamp `deviation` in place, returns the pixels whose step has persisted
+
+    `count` holds how many frames in a row each pixel has been more than
+    `clamp` from its estimate. Those pixels are reset and their count cleared.
+    """
+
+    outside = np.abs(deviation) > clamp
+    np.multiply(count + 1, outside, out=count)
+    jump = count >= persist
+    count[jump] = 0
+    np.clip(deviation, -clamp, clamp, out=deviation)
+    return jump
+
+
+class EMAFilter(object):
+    """Per-pixel exponential moving average with outlier clamping
+
+    Each new reading may move a pixel by at most `clamp` degrees before
+    smoothing, so single frame spikes are limited. A step that lasts
+    `persist` frames is genuine and the pixel jumps straight to the reading.
+    """
+
+    def __init__(self, alpha=0.3, clamp=5.0, persist=PERSIST, pixels=PIXELS):
+
+        self.alpha = alpha
+        self.clamp = clamp
+        self.persist = persist
+
+        self.estimate = np.zeros(pixels)
+        self._delta = np.zeros(pixels)
+        self._outlying = np.zeros(pixels, dtype=int)
+        self.initialised = False
+
+    def update(self, frame, out):
+        if not self.initialised:
+            self.estimate[:] = frame
+            self.initialised = True
+        else:
+            delta = self._delta
+            np.subtract(frame, self.estimate, out=delta)
+            jump = _limit(delta, self.clamp, self._outlying, self.persist)
+            delta *= self.alpha
+            self.estimate += delta
+            self.estimate[jump] = frame[jump]
+
+        out[:] = self.estimate
+
+
+class KalmanFilter(object):
+    """Independent scalar Kalman filter for every pixel (random walk model)
+
+    `process_noise` is the expected variance of the true temperature change
+    between frames and `measurement_noise` the variance of the sensor reading.
+    The innovation is clamped to `clamp` degrees to reject outliers, unless
+    it persists for `persist` frames, when the pixel restarts from the reading.
+    """
+
+    def __init__(
+        self,
+        process_noise=0.05,
+        measurement_noise=1.0,
+        clamp=5.0,
+        persist=PERSIST,
+        pixels=PIXELS,
+    ):
+
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.clamp = clamp
+        self.persist = persist
+
+        self.estimate = np.zeros(pixels)
+        self.variance = np.full(pixels, measurement_noise)
+        self._innovation = np.zeros(pixels)
+        self._gain = np.zeros(pixels)
+        self._outlying = np.zeros(pixels, dtype=int)
+        self.initialised = False
+
+    def update(self, frame, out):
+        if not self.initialised:
+            self.estimate[:] = frame
+            self.initialised = True
+        else:
+            variance = self.variance
+            gain = self._gain
+            innovation = self._innovation
+
+            # Predict
+            variance += self.process_noise
+
+            # Update
+            np.add(variance, self.measurement_noise, out=gain)
+            np.divide(variance, gain, out=gain)
+
+            np.subtract(frame, self.estimate, out=innovation)
+            jump = _limit(innovation, self.clamp, self._outlying, self.persist)
+            innovation *= gain
+            self.estimate += innovation
+
+            gain -= 1
+            variance *= -gain
+
+            self.estimate[jump] = frame[jump]
+            variance[jump] = self.measurement_noise
+
+        out[:] = self.estimate
+
+
+class PassThrough(object):
+    """No filtering, frames are copied unchanged"""
+
+    def update(self, frame, out):
+        out[:] = frame
+
+
+def make_filter(settings):
+    """Build the filter named by the `thermal_filter` setting"""
+
+    name = settings.get_setting("thermal_filter")
+    if name == "ema":
+        return EMAFilter(
+            alpha=settings.get_setting("thermal_filter_alpha"),
+            clamp=settings.get_setting("thermal_filter_clamp"),
+            persist=settings.get_setting("thermal_filter_persist"),
+        )
+    elif name == "kalman":
+        return KalmanFilter(
+            process_noise=settings.get_setting("thermal_filter_process_noise"),
+            measurement_noise=settings.get_setting("thermal_filter_measurement_noise"),
+            clamp=settings.get_setting("thermal_filter_clamp"),
+            persist=settings.get_setting("thermal_filter_persist"),
+        )
+    elif name == "none":
+        return PassThrough()
+    else:
+        raise ValueError("Unknown thermal_filter %s" % (name))
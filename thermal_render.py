@@ -0,0 +1,78 @@
+import math
+import numpy as np
+from PIL import Image
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+INTERPOLATE = 10
+
+MINTEMP = 20.0  # -40 #low range of the sensor (this will be black on the screen)
+MAXTEMP = 200.0  # previous 50 #max 300 #high range of the sensor (this will be white on the screen)
+
+SENSOR_SHAPE = (24, 32)  # MLX90640 rows, columns
+IMAGE_SIZE = (24 * INTERPOLATE, 24 * INTERPOLATE)
+
+
+# the list of colors we can choose from
+heatmap = (
+    (0.0, (0, 0, 0)),
+    (0.20, (0, 0, 0.5)),
+    (0.40, (0, 0.5, 0)),
+    (0.60, (0.5, 0, 0)),
+    (0.80, (0.75, 0.75, 0)),
+    (0.90, (1.0, 0.75, 0)),
+    (1.00, (1.0, 1.0, 1.0)),
+)
+
+# how many color values we can have
+COLORDEPTH = 1000
+
+
+def _gaussian(x, a, b, c, d=0):
+    return a * math.exp(-((x - b) ** 2) / (2 * c ** 2)) + d
+
+
+def _gradient(x, width, cmap, spread=1):
+    width = float(width)
+    rgb = []
+    for channel in range(3):
+        value = sum(
+            [
+                _gaussian(x, p[1][channel], p[0] * width, width / (spread * len(cmap)))
+                for p in cmap
+            ]
+        )
+        rgb.append(int(min(255, max(0, value * 255))))
+    return tuple(rgb)
+
+
+def build_colormap(depth=COLORDEPTH, cmap=heatmap):
+    """Build the false colour lookup table as a (depth, 3) uint8 array"""
+    return np.array([_gradient(i, depth, cmap) for i in range(depth)], dtype=np.uint8)
+
+
+# Built once at import, shared by every frame
+COLORMAP = build_colormap()
+
+
+def colorize(frame, min_temp=MINTEMP, max_temp=MAXTEMP, colormap=COLORMAP):
+    """Map a 768 pixel frame to a (24, 32, 3) uint8 RGB array in one pass"""
+    depth = len(colormap)
+    frame = np.asarray(frame, dtype=np.float32).reshape(SENSOR_SHAPE)
+    index = (frame - min_temp) * ((depth - 1) / (max_temp - min_temp))
+    index = np.clip(index, 0, depth - 1).astype(np.intp)
+    return colormap[index]
+
+
+def render(frame, size=IMAGE_SIZE):
+    """Render a thermal frame to an upright false colour PIL image
+
+    Rotating 90 degrees then flipping left to right is a transverse, so the
+    orientation is applied as a free array view and PIL only resizes once.
+    """
+    rgb = colorize(frame)[::-1, ::-1].transpose(1, 0, 2)
+    img = Image.fromarray(np.ascontiguousarray(rgb), "RGB")
+    return img.resize(size, Image.BICUBIC)
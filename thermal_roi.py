@@ -0,0 +1,137 @@
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MIN_CONTRAST = 8.0  # Degrees above background before anything counts as a pan
+MIN_PIXELS = 6  # Smallest blob accepted as a pan
+SCENE_CHANGE = 1.5  # Mean absolute change in degrees that triggers re-segmentation
+MAX_AGE = 160  # Frames before the mask is refreshed regardless (10 s at 16 fps)
+PERCENTILE = 90
+
+SENSOR_SHAPE = (24, 32)
+
+# Used until a pan has been found
+CENTER_SQUARE = [72, 73, 74, 75, 88, 89, 90, 91, 104, 105, 106, 107, 120, 121, 122, 123]
+
+
+def label_components(mask):
+    """Label 4-connected components of a boolean image
+
+    Each pixel starts with its own index and repeatedly takes the smallest
+    label among its masked neighbours, so the whole image is processed per
+    step instead of flood filling pixel by pixel.
+    """
+
+    rows, columns = mask.shape
+    unset = rows * columns
+    labels = np.where(mask, np.arange(unset).reshape(mask.shape), unset)
+    padded = np.full((rows + 2, columns + 2), unset)
+
+    while True:
+        padded[1:-1, 1:-1] = labels
+        neighbours = np.minimum(
+            np.minimum(padded[:-2, 1:-1], padded[2:, 1:-1]),
+            np.minimum(padded[1:-1, :-2], padded[1:-1, 2:]),
+        )
+        updated = np.where(mask, np.minimum(labels, neighbours), unset)
+        if np.array_equal(updated, labels):
+            return labels, unset
+        labels = updated
+
+
+def segment(frame, min_contrast=MIN_CONTRAST, min_pixels=MIN_PIXELS):
+    """Return a boolean mask of the largest hot blob, None if there is no pan"""
+
+    frame = frame.reshape(SENSOR_SHAPE)
+
+    background = np.median(frame)
+    hot = np.percentile(frame, 98)
+    if hot - background < min_contrast:
+        return None
+
+    # Split halfway between the background and the hottest area
+    mask = frame > (background + hot) / 2
+
+    labels, unset = label_components(mask)
+    components, sizes = np.unique(labels[mask], return_counts=True)
+    if len(components) == 0 or sizes.max() < min_pixels:
+        return None
+
+    return labels == components[np.argmax(sizes)]
+
+
+class PanROI(object):
+    """Track the pan in thermal frames and summarise its temperature
+
+    The mask is cached and only segmented again once the scene has moved by
+    more than `scene_change` degrees on average, or after `max_age` frames, so
+    most frames only cost a difference and a masked reduction.
+    """
+
+    def __init__(
+        self, scene_change=SCENE_CHANGE, max_age=MAX_AGE, percentile=PERCENTILE
+    ):
+
+        self.scene_change = scene_change
+        self.max_age = max_age
+        self.percentile = percentile
+
+        fallback = np.zeros(768, dtype=bool)
+        fallback[CENTER_SQUARE] = True
+        self.fallback = fallback
+
+        # Replaced as a tuple so readers in other threads see a consistent pair
+        self.state = (fallback, None, 0)
+        self.found = False
+        self.segmentations = 0
+
+    def _segment(self, frame):
+        mask = segment(frame)
+        self.segmentations += 1
+        self.found = mask is not None
+        if mask is None:
+            logger.debug("No pan found, using centre square")
+            mask = self.fallback
+        else:
+            logger.debug("Pan found covering %d pixels" % (np.count_nonzero(mask)))
+        self.state = (mask.ravel(), frame.copy(), 0)
+
+    def update(self, frame):
+        """Return the pan mask for this frame, re-segmenting only on change"""
+
+        frame = np.asarray(frame, dtype=np.float32).ravel()
+        mask, reference, age = self.state
+
+        if (
+            reference is None
+            or age >= self.max_age
+            or np.mean(np.abs(frame - reference)) > self.scene_change
+        ):
+            self._segment(frame)
+            return self.state[0]
+
+        self.state = (mask, reference, age + 1)
+        return mask
+
+    def measure(self, frame):
+        """Return mean, max and percentile temperature inside the pan mask"""
+
+        frame = np.asarray(frame, dtype=np.float32).ravel()
+        values = np.sort(frame[self.update(frame)])
+
+        # Linear interpolation as np.percentile, which is slow for small arrays
+        position = (values.size - 1) * self.percentile / 100
+        lower = int(position)
+        upper = min(lower + 1, values.size - 1)
+        percentile = values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+        return {
+            "mean": float(values.mean()),
+            "max": float(values[-1]),
+            "percentile": float(percentile),
+            "pixels": int(values.size),
+            "found": self.found,
+        }
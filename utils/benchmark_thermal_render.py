@@ -0,0 +1,110 @@
+"""Compare the legacy per-pixel thermal renderer against the NumPy LUT renderer
+
+Run from the repository root: PYTHONPATH=. python3 utils/benchmark_thermal_render.py
+"""
+
+import argparse
+import math
+import random
+import time
+
+from PIL import Image
+
+from thermal_render import (
+    COLORDEPTH,
+    IMAGE_SIZE,
+    MAXTEMP,
+    MINTEMP,
+    heatmap,
+    render,
+)
+
+
+def legacy_render(frame):
+    """Previous `ThermalCamera._worker._image`, minus the file save"""
+
+    def _constrain(val, min_val, max_val):
+        return min(max_val, max(min_val, val))
+
+    def _map_value(x, in_min, in_max, out_min, out_max):
+        return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+    def _gaussian(x, a, b, c, d=0):
+        return a * math.exp(-((x - b) ** 2) / (2 * c ** 2)) + d
+
+    def _gradient(x, width, cmap, spread=1):
+        width = float(width)
+        r = sum(
+            [_gaussian(x, p[1][0], p[0] * width, width / (spread * len(cmap))) for p in cmap]
+        )
+        g = sum(
+            [_gaussian(x, p[1][1], p[0] * width, width / (spread * len(cmap))) for p in cmap]
+        )
+        b = sum(
+            [_gaussian(x, p[1][2], p[0] * width, width / (spread * len(cmap))) for p in cmap]
+        )
+        r = int(_constrain(r * 255, 0, 255))
+        g = int(_constrain(g * 255, 0, 255))
+        b = int(_constrain(b * 255, 0, 255))
+        return r, g, b
+
+    colormap = [0] * COLORDEPTH
+    for i in range(COLORDEPTH):
+        colormap[i] = _gradient(i, COLORDEPTH, heatmap)
+
+    pixels = [0] * 768
+    for i, pixel in enumerate(frame):
+        coloridx = _map_value(pixel, MINTEMP, MAXTEMP, 0, COLORDEPTH - 1)
+        coloridx = int(_constrain(coloridx, 0, COLORDEPTH - 1))
+        pixels[i] = colormap[coloridx]
+
+    img = Image.new("RGB", (32, 24))
+    img.putdata(pixels)
+    img = img.resize(IMAGE_SIZE, Image.BICUBIC)
+
+    img = img.transpose(method=Image.ROTATE_90)
+    img = img.transpose(method=Image.FLIP_LEFT_RIGHT)
+    return img
+
+
+def synthetic_frame():
+    """Warm background with a hot pan in the middle, plus sensor noise"""
+    frame = []
+    for row in range(24):
+        for column in range(32):
+            distance = math.hypot(row - 12, column - 16)
+            temperature = 25 + 150 * math.exp(-(distance ** 2) / 40)
+            frame.append(temperature + random.gauss(0, 1))
+    return frame
+
+
+def time_renderer(function, frames, repeats):
+    stamp = time.perf_counter()
+    for _ in range(repeats):
+        for frame in frames:
+            function(frame)
+    return (time.perf_counter() - stamp) / (repeats * len(frames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=10, help="Distinct frames")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes per frame")
+    args = parser.parse_args()
+
+    frames = [synthetic_frame() for _ in range(args.frames)]
+
+    # Warm up both paths so imports and allocations are not measured
+    legacy_render(frames[0])
+    render(frames[0])
+
+    legacy = time_renderer(legacy_render, frames, args.repeats)
+    vectorised = time_renderer(render, frames, args.repeats)
+
+    print("Legacy renderer: %0.2f ms per frame" % (legacy * 1000))
+    print("NumPy renderer:  %0.2f ms per frame" % (vectorised * 1000))
+    print("Speed up:        %0.1fx" % (legacy / vectorised))
+
+
+if __name__ == "__main__":
+    main()
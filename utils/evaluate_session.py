@@ -0,0 +1,353 @@
+"""Evaluate classifiers from config.json against a recorded, labelled session
+
+Streams every image listed in the session's camera/labels.csv through the
+chosen models on a pool of worker processes, then reports accuracy, confusion
+matrices, threshold sweeps and per-image latency:
+
+    PYTHONPATH=. python3 utils/evaluate_session.py sessions/monday1 --models pasta,sauce
+    PYTHONPATH=. python3 utils/evaluate_session.py sessions/monday1 --models boilover \\
+        --backend tflite --num-threads 1 --workers 4 --json boilover.json
+
+The Edge TPU can only be opened by one process, use --workers 1 with it.
+Thermal and fused models read the session's thermal archive, matched to each
+image by measurement ID and time stamp. The archive holds raw frames, while
+the live classifier sees frames after the thermal_filter smoothing, so scores
+for thermal models can differ from those seen on the bot.
+With --cache, results are stored by model and input hash so repeat runs only
+invoke models or images that have changed.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import re
+import time
+from datetime import datetime
+from os import path
+
+import numpy as np
+
+import config
+from config import Classifiers
+from inference import open_engine, read_labels
+from preprocess import SOURCES, Preprocessor
+from result_cache import ResultCache, file_hash, frame_hash
+from thermal_archive import open_archive
+
+
+SWEEP = np.round(np.arange(0.05, 1.0, 0.05), 2)
+TOP_K = 1000  # Every label, so thresholds can be swept afterwards
+ARCHIVE = "thermal_frames.bin"
+
+# session_00012_2020-01-11_18-45-13-068000_camera_label.jpg
+#     -> (12, "2020-01-11_18-45-13-068000")
+MEASUREMENT = re.compile(r"_(\d+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6})_camera_")
+TIME_FORMAT = "%Y-%m-%d_%H-%M-%S-%f"
+
+# Loaded once in each worker process by _init_worker
+engines = {}
+modalities = {}
+hashes = {}
+cache = None
+thermal = None
+
+
+def read_session(session_dir):
+    """Returns (image path, label) pairs from the session's labels.csv"""
+
+    camera_dir = path.join(session_dir, "camera")
+    samples = []
+    with open(path.join(camera_dir, "labels.csv")) as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header line
+        for row in reader:
+            if len(row) < 2 or row[1] in ("", "None"):
+                continue
+
+            # gs://bucket/session/camera/label/filename -> session/camera/label/filename
+            label_dir, filename = row[0].split("/")[-2:]
+            samples.append((path.join(camera_dir, label_dir, filename), row[1]))
+    return samples
+
+
+def _key(measurement_ID, time_stamp):
+    """Measurement IDs restart with every run, so resumed sessions repeat them"""
+    return int(measurement_ID), int(round(time_stamp * 1e6))
+
+
+def read_thermal(archive_path):
+    """Returns {(measurement ID, microseconds): raw thermal frame} from an archive"""
+
+    records = open_archive(archive_path)
+    keys = zip(records["measurement_ID"], records["time_stamp"])
+    return {_key(*key): records["frame"][row] for row, key in enumerate(keys)}
+
+
+def _thermal_frame(file_path):
+    match = MEASUREMENT.search(path.basename(file_path))
+    if thermal is None or match is None:
+        return None
+    # Same local time the main loop passed to timestamp() when archiving
+    time_stamp = datetime.strptime(match.group(2), TIME_FORMAT).timestamp()
+    frame = thermal.get(_key(match.group(1), time_stamp))
+    return None if frame is None else np.asarray(frame, dtype=np.float32).ravel()
+
+
+def _init_worker(attrs, cache_path, archive_path):
+    global cache, thermal
+    for name, attr in attrs.items():
+        engines[name] = open_engine(attr)
+        modalities[name] = attr.get("input", "camera")
+        hashes[name] = file_hash(attr["model"])
+    if cache_path:
+        cache = ResultCache(cache_path)
+    if archive_path:
+        thermal = read_thermal(archive_path)
+
+
+def _classify(file_path):
+    """Returns (file_path, {name: (probabilities, preprocess s, invoke s)})
+
+    Outputs are None if the image cannot be read, and a model's output is None
+    if the image has no thermal frame it needs. Invoke time is None for results
+    taken from the cache.
+    """
+
+    preprocessor = Preprocessor(file_path, thermal=_thermal_frame(file_path))
+    try:
+        preprocessor.thumbnail()  # Decode once up front
+    except OSError:
+        return file_path, None
+
+    outputs = {}
+    for name, engine in engines.items():
+        modality = modalities[name]
+        if not preprocessor.available(modality):
+            outputs[name] = None
+            continue
+
+        start = time.monotonic()
+        tensor = preprocessor.tensor(engine.input_shape, engine.input_dtype, modality)
+        preprocessed = time.monotonic()
+
+        results = None
+        if cache is not None:
+            key = frame_hash(tensor)
+            results = cache.get(hashes[name], key, TOP_K)
+        if results is None:
+            results = engine.classify(tensor, top_k=TOP_K)
+            invoke = time.monotonic() - preprocessed
+            if cache is not None:
+                cache.put(hashes[name], key, TOP_K, results)
+        else:
+            invoke = None
+
+        probabilities = np.zeros(max(index for index, _ in results) + 1)
+        for index, probability in results:
+            probabilities[index] = probability
+        outputs[name] = (probabilities, preprocessed - start, invoke)
+    return file_path, outputs
+
+
+def _sweep(probabilities, truth, column):
+    """Precision and recall of `probability >= threshold` for one label"""
+
+    positive = truth == column
+    sweep = []
+    for threshold in SWEEP:
+        predicted = probabilities[:, column] >= threshold
+        hits = np.count_nonzero(predicted & positive)
+        sweep.append(
+            {
+                "threshold": float(threshold),
+                "precision": hits / max(np.count_nonzero(predicted), 1),
+                "recall": hits / max(np.count_nonzero(positive), 1),
+            }
+        )
+    return sweep
+
+
+def _latency(seconds):
+    if not seconds:
+        return None
+    seconds = np.asarray(seconds) * 1000
+    return {
+        "mean_ms": float(seconds.mean()),
+        "p50_ms": float(np.percentile(seconds, 50)),
+        "p95_ms": float(np.percentile(seconds, 95)),
+        "max_ms": float(seconds.max()),
+    }
+
+
+def evaluate(name, labels, samples, outputs):
+    """Metrics for one model over the samples whose label it knows"""
+
+    indices = {label: index for index, label in labels.items()}
+    size = max(labels) + 1
+
+    truth = []
+    probabilities = []
+    preprocess = []
+    invoke = []
+    for file_path, label in samples:
+        if label not in indices or outputs.get(file_path, {}).get(name) is None:
+            continue
+        probability, preprocess_time, invoke_time = outputs[file_path][name]
+        row = np.zeros(size)
+        row[: min(size, probability.size)] = probability[:size]
+        truth.append(indices[label])
+        probabilities.append(row)
+        preprocess.append(preprocess_time)
+        if invoke_time is not None:
+            invoke.append(invoke_time)
+
+    report = {"images": len(truth), "cached": len(truth) - len(invoke)}
+    if not truth:
+        return report
+
+    truth = np.array(truth)
+    probabilities = np.array(probabilities)
+    predicted = probabilities.argmax(axis=1)
+
+    confusion = np.zeros((size, size), dtype=int)
+    np.add.at(confusion, (truth, predicted), 1)
+
+    report.update(
+        {
+            "accuracy": float(np.mean(predicted == truth)),
+            "labels": [labels[index] for index in range(size)],
+            "confusion": confusion.tolist(),  # Rows are true, columns predicted
+            "threshold_sweep": {
+                labels[index]: _sweep(probabilities, truth, index)
+                for index in range(size)
+            },
+            "preprocess": _latency(preprocess),
+            "invoke": _latency(invoke),
+        }
+    )
+    return report
+
+
+def print_report(name, report):
+    print("\n%s: %d labelled images" % (name, report["images"]))
+    if not report["images"]:
+        return
+
+    print("  accuracy %.3f" % (report["accuracy"]))
+    if report["cached"]:
+        print("  %d results from the cache" % (report["cached"]))
+    if report["invoke"]:
+        print(
+            "  latency per image: preprocess %.1f ms, invoke %.1f ms (p95 %.1f ms)"
+            % (
+                report["preprocess"]["mean_ms"],
+                report["invoke"]["mean_ms"],
+                report["invoke"]["p95_ms"],
+            )
+        )
+
+    width = max(len(label) for label in report["labels"])
+    print("  confusion (rows true, columns predicted)")
+    for label, row in zip(report["labels"], report["confusion"]):
+        print("    %s %s" % (label.ljust(width), " ".join("%6d" % n for n in row)))
+
+    print("  best F1 threshold per label")
+    for label, sweep in report["threshold_sweep"].items():
+        scores = [
+            (2 * s["precision"] * s["recall"] / (s["precision"] + s["recall"]), s)
+            for s in sweep
+            if s["precision"] + s["recall"]
+        ]
+        if scores:
+            f1, best = max(scores, key=lambda score: score[0])
+            print(
+                "    %s %.2f (precision %.3f, recall %.3f, F1 %.3f)"
+                % (
+                    label.ljust(width),
+                    best["threshold"],
+                    best["precision"],
+                    best["recall"],
+                    f1,
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("session", help="Recorded session directory")
+    parser.add_argument("--models", required=True, help="Comma separated classifiers")
+    parser.add_argument("--config", default=config.FILE, help="config.json to use")
+    parser.add_argument("--backend", help="Override each classifier's backend")
+    parser.add_argument("--num-threads", type=int, help="Threads per CPU interpreter")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count())
+    parser.add_argument("--limit", type=int, help="Only evaluate the first N images")
+    parser.add_argument("--json", help="Also write the full report to this file")
+    parser.add_argument("--cache", help="SQLite file to reuse results across runs")
+    args = parser.parse_args()
+
+    config.FILE = args.config
+    library = Classifiers().get_classifiers()
+
+    attrs = {}
+    labels = {}
+    for name in args.models.split(","):
+        attr = dict(library[name])
+        if args.backend:
+            attr["backend"] = args.backend
+        if args.num_threads:
+            attr["num_threads"] = args.num_threads
+        attrs[name] = attr
+        labels[name] = read_labels(attr["labels"])
+
+    # Thermal inputs come from the archive recorded alongside the images
+    archive_path = None
+    thermal_models = [
+        name
+        for name, attr in attrs.items()
+        if "thermal" in SOURCES[attr.get("input", "camera")]
+    ]
+    if thermal_models:
+        archive_path = path.join(args.session, ARCHIVE)
+        if not path.isfile(archive_path):
+            parser.error(
+                "%s need thermal frames but %s does not exist"
+                % (", ".join(thermal_models), archive_path)
+            )
+
+    samples = read_session(args.session)[: args.limit]
+    files = sorted({file_path for file_path, _ in samples})
+    print("Classifying %d images with %s" % (len(files), ", ".join(attrs)))
+
+    start = time.monotonic()
+    outputs = {}
+    initargs = (attrs, args.cache, archive_path)
+    with mp.Pool(args.workers, initializer=_init_worker, initargs=initargs) as pool:
+        chunksize = max(1, len(files) // (args.workers * 16))
+        for done, (file_path, output) in enumerate(
+            pool.imap_unordered(_classify, files, chunksize=chunksize), 1
+        ):
+            if output is None:
+                print("  Skipping unreadable %s" % (file_path))
+            else:
+                outputs[file_path] = output
+            if done % 1000 == 0:
+                print("  %d / %d" % (done, len(files)))
+    elapsed = time.monotonic() - start
+    print(
+        "Classified in %.1f s (%.0f images per second)"
+        % (elapsed, len(files) / max(elapsed, 1e-9))
+    )
+
+    reports = {}
+    for name in attrs:
+        reports[name] = evaluate(name, labels[name], samples, outputs)
+        print_report(name, reports[name])
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(reports, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Check the NumPy MLX90640 calculation against the adafruit implementation
+
+Record raw subpages from the sensor, then compare both calculations offline:
+
+    PYTHONPATH=. python3 utils/verify_thermal_calc.py record raw_frames.npz --frames 200
+    PYTHONPATH=. python3 utils/verify_thermal_calc.py check raw_frames.npz
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import adafruit_mlx90640
+from mlx90640_calc import FRAME_WORDS, FrameCalculator
+
+
+def record(path, frames):
+    import board
+    import busio
+
+    i2c = busio.I2C(board.SCL, board.SDA)
+    mlx = adafruit_mlx90640.MLX90640(i2c)
+    mlx.refresh_rate = adafruit_mlx90640.RefreshRate.REFRESH_32_HZ
+
+    raw = np.zeros((frames, FRAME_WORDS), dtype=np.int32)
+    subpage = [0] * FRAME_WORDS
+    for i in range(frames):
+        mlx._GetFrameData(subpage)
+        raw[i] = subpage
+
+    np.savez_compressed(path, eeprom=np.array(adafruit_mlx90640.eeData), raw=raw)
+    print("Recorded %d raw subpages to %s" % (frames, path))
+
+
+def check(path, tolerance):
+    recording = np.load(path)
+
+    # Rebuild the calibration from the recorded EEPROM without touching I2C
+    adafruit_mlx90640.eeData[:] = [int(word) for word in recording["eeprom"]]
+    mlx = adafruit_mlx90640.MLX90640.__new__(adafruit_mlx90640.MLX90640)
+    mlx._ExtractParameters()
+    calculator = FrameCalculator(mlx)
+
+    worst = 0
+    adafruit_time = 0
+    numpy_time = 0
+    for raw in recording["raw"]:
+        frame_data = [int(word) for word in raw]
+        tr = mlx._GetTa(frame_data) - adafruit_mlx90640.OPENAIR_TA_SHIFT
+
+        expected = [0] * 768
+        stamp = time.perf_counter()
+        mlx._CalculateTo(frame_data, 0.95, tr, expected)
+        adafruit_time += time.perf_counter() - stamp
+
+        result = np.zeros(768)
+        stamp = time.perf_counter()
+        calculator.calculate(raw, result, tr=tr)
+        numpy_time += time.perf_counter() - stamp
+
+        mask = calculator.subpage_mask(raw)
+        worst = max(worst, np.abs(np.array(expected)[mask] - result[mask]).max())
+
+    count = len(recording["raw"])
+    print("Compared %d subpages, largest difference %0.3g C" % (count, worst))
+    print("adafruit: %0.2f ms per subpage" % (adafruit_time * 1000 / count))
+    print("NumPy:    %0.2f ms per subpage" % (numpy_time * 1000 / count))
+
+    if worst > tolerance:
+        raise SystemExit("Difference exceeds tolerance of %s C" % (tolerance))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("mode", choices=["record", "check"])
+    parser.add_argument("path", help="Recording .npz file")
+    parser.add_argument("--frames", type=int, default=100, help="Subpages to record")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="Degrees C")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        record(args.path, args.frames)
+    else:
+        check(args.path, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()